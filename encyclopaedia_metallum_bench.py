@@ -0,0 +1,441 @@
+"""Benchmarks the crawler against a local stand-in for Encyclopaedia
+Metallum, e.g.
+
+    python encyclopaedia_metallum_bench.py --engines threads async \
+        --threads 16 64 --error-rate 0.01 --max-pages-per-second 200
+
+Every stage is run for each engine and thread count, reporting pages/sec,
+p50/p99 fetch latency and peak RSS"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import re
+import statistics
+import tempfile
+import time
+import traceback
+
+import multiprocessing as mp
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import encyclopaedia_metallum_etl as etl
+
+try:
+    import resource
+except ImportError:  # peak RSS is only reported on unix
+    resource = None
+
+
+BANDS_PER_LETTER = 50
+ALBUMS_PER_BAND = 3
+TRACKS_PER_ALBUM = 9
+
+# seconds added to every response, plus up to LATENCY_JITTER more
+LATENCY = 0.05
+LATENCY_JITTER = 0.02
+
+# how often the parent checks that a benchmark process is still running
+POLL_SECONDS = 1.0
+
+# markup that real pages carry around the tables the parsers read
+PAGE_PADDING = '<div class="menu"><a href="#">link</a></div>\n' * 400
+
+STAGES = (('bands', {'bands': True}),
+          ('albums', {'bands': False, 'albums': True}),
+          ('tracks', {'bands': False, 'tracks': True}))
+
+
+class StandInConfig:
+    '''The site that the stand-in server pretends to be'''
+
+    def __init__(self, bands_per_letter=BANDS_PER_LETTER,
+                 albums_per_band=ALBUMS_PER_BAND,
+                 tracks_per_album=TRACKS_PER_ALBUM, latency=LATENCY,
+                 latency_jitter=LATENCY_JITTER, error_rate=0.0,
+                 throttle_rate=0.0, max_pages_per_second=None,
+                 replay_cache=None):
+        self.bands_per_letter = bands_per_letter
+        self.albums_per_band = albums_per_band
+        self.tracks_per_album = tracks_per_album
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_pages_per_second = max_pages_per_second
+        self.replay_cache = replay_cache
+
+
+def _letter_page(config, base_url, letter, start, length):
+    total = config.bands_per_letter
+    letter_index = etl.ALPHABET.index(letter)
+
+    records = []
+    for band_number in range(start, min(total, start + length)):
+        band_id = letter_index * total + band_number + 1
+        band_name = f'{letter} Band {band_number}'
+        band_url = f'{base_url}/bands/{band_name.replace(" ", "_")}/{band_id}'
+        records.append([f"<a href='{band_url}'>{band_name}</a>",
+                        'Norway', 'Black/Death Metal',
+                        '<span class="active">Active</span>'])
+
+    return json.dumps({'iTotalRecords': total, 'iTotalDisplayRecords': total,
+                       'sEcho': 1, 'aaData': records})
+
+
+def _discography_page(config, base_url, band_id):
+    rows = []
+    for album_number in range(config.albums_per_band):
+        album_id = band_id * config.albums_per_band + album_number
+        album_url = f'{base_url}/albums/Band/Album_{album_number}/{album_id}'
+        rows.append(f'<tr><td><a href="{album_url}" class="album">'
+                    f'Album {album_number}</a></td>'
+                    '<td class="album">Full-length</td>'
+                    f'<td class="album">{1990 + album_number}</td>'
+                    '<td><a href="#">3 (80%)</a></td></tr>')
+
+    return ('<table class="display discog"><thead><tr><th>Name</th>'
+            '<th>Type</th><th>Year</th><th>Reviews</th></tr></thead>'
+            f'<tbody>{"".join(rows)}</tbody></table>')
+
+
+def _album_page(config):
+    rows = []
+    for track_number in range(1, config.tracks_per_album + 1):
+        row_class = 'even' if track_number % 2 else 'odd'
+        rows.append(f'<tr class="{row_class}"><td width="20">'
+                    f'{track_number}.</td><td class="wrapWords">'
+                    f'Track {track_number}</td><td align="right">'
+                    f'0{track_number % 10}:00</td><td nowrap="nowrap">'
+                    '&nbsp;</td></tr>')
+
+    return (f'<html><body>{PAGE_PADDING}'
+            '<table class="display table_lyrics" cellpadding="0" '
+            f'cellspacing="0"><tbody>{"".join(rows)}</tbody></table>'
+            f'{PAGE_PADDING}</body></html>')
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in separate writes, which on a keep-alive
+    # connection would otherwise wait ~40ms on a delayed ack each time
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='text/html', headers=None):
+        body_bytes = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body_bytes)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def _replay(self, config, base_url):
+        cache = etl.ResponseCache(config.replay_cache, offline=True)
+        entry = cache.get(f'{etl.METAL_ARCHIVES_URL}{self.path}')
+        if entry is None:
+            return self._send(404, 'not recorded')
+
+        page_text, _ = entry
+        page_text = page_text.replace(etl.METAL_ARCHIVES_URL, base_url)
+        self._send(200, page_text)
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        base_url = f'http://{server.server_address[0]}:{server.server_port}'
+
+        if server.limiter is not None:
+            server.limiter.acquire()
+
+        time.sleep(config.latency + random.random() * config.latency_jitter)
+
+        roll = random.random()
+        if roll < config.error_rate:
+            return self._send(520, 'web server returned an unknown error')
+        if roll < config.error_rate + config.throttle_rate:
+            return self._send(429, 'too many requests',
+                              headers={'Retry-After': '1'})
+
+        if config.replay_cache is not None:
+            return self._replay(config, base_url)
+
+        url = urlparse(self.path)
+
+        letter_match = re.match(r'^/browse/ajax-letter/l/(.+)/json$',
+                                url.path)
+        if letter_match:
+            query = parse_qs(url.query)
+            page_text = _letter_page(config, base_url, letter_match.group(1),
+                                     int(query['iDisplayStart'][0]),
+                                     int(query['iDisplayLength'][0]))
+            return self._send(200, page_text, 'application/json')
+
+        band_match = re.match(r'^/band/discography/id/(\d+)/tab/all$',
+                              url.path)
+        if band_match:
+            page_text = _discography_page(config, base_url,
+                                          int(band_match.group(1)))
+            return self._send(200, page_text)
+
+        if url.path.startswith('/albums/'):
+            return self._send(200, _album_page(config))
+
+        self._send(404, 'not found')
+
+
+class _StandInHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # the default backlog of 5 drops connections when a crawl starts
+    request_queue_size = 1024
+
+
+def _serve(config, address_queue):
+    server = _StandInHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    server.config = config
+
+    server.limiter = None
+    if config.max_pages_per_second:
+        rate = config.max_pages_per_second
+        server.limiter = etl.RateLimiter(rate, min_rate=rate, max_rate=rate)
+
+    address_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class StandInServer:
+    '''Runs the stand-in site in its own process, so that serving pages
+    doesn't compete with the crawler for the GIL'''
+
+    def __init__(self, config):
+        self.config = config
+        self._process = None
+        self.url = None
+
+    def start(self):
+        context = mp.get_context('spawn')
+        address_queue = context.Queue()
+        self._process = context.Process(target=_serve,
+                                        args=(self.config, address_queue),
+                                        daemon=True)
+        self._process.start()
+        self.url = f'http://127.0.0.1:{address_queue.get(timeout=30)}'
+        return self
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _peak_rss_mib():
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on linux
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return max(usage.ru_maxrss, children_usage.ru_maxrss) / 1024
+
+
+def _percentile(latencies, percent):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else None
+    return statistics.quantiles(latencies, n=100)[percent - 1]
+
+
+def _run_benchmark(url, engine, threads, options, result_queue):
+    """Crawls the stand-in site in a fresh process and reports each stage,
+    or the traceback of whatever stopped the crawl"""
+    try:
+        result_queue.put(_crawl_stages(url, engine, threads, options))
+    except Exception:
+        result_queue.put(traceback.format_exc())
+
+
+def _crawl_stages(url, engine, threads, options):
+    latencies = []
+    fetch = etl._fetch
+    fetch_async = etl._fetch_async
+
+    def _timed_fetch(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fetch(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    async def _timed_fetch_async(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fetch_async(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    etl._fetch = _timed_fetch
+    etl._fetch_async = _timed_fetch_async
+
+    etl.METAL_ARCHIVES_URL = url
+    etl.Output.log.disable()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+
+        for stage, stage_kwargs in STAGES:
+            latencies.clear()
+            start = time.perf_counter()
+            etl.download_data(engine=engine, cache=False, pool_size=threads,
+                              threads=threads, concurrency=threads,
+                              **stage_kwargs, **options)
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                'engine': engine, 'workers': threads, 'stage': stage,
+                'pages': len(latencies),
+                'seconds': round(elapsed, 3),
+                'pages_per_second': round(len(latencies) / elapsed, 1),
+                'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+                'p99_ms': round(_percentile(latencies, 99) * 1000, 1),
+                'peak_rss_mib': round(_peak_rss_mib() or 0, 1)
+            })
+
+        os.chdir(tempfile.gettempdir())
+
+    return results
+
+
+def _wait_for_results(process, result_queue):
+    """Returns the results of a benchmark process, raising if it failed or
+    died without reporting any"""
+    while True:
+        try:
+            run_results = result_queue.get(timeout=POLL_SECONDS)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+
+        # it may have reported just before exiting
+        try:
+            run_results = result_queue.get(timeout=POLL_SECONDS)
+            break
+        except queue.Empty:
+            msg = (f'the benchmark process exited with code '
+                   f'{process.exitcode} without reporting results')
+            raise RuntimeError(msg) from None
+
+    if isinstance(run_results, str):
+        raise RuntimeError(f'the benchmark process failed:\n{run_results}')
+
+    return run_results
+
+
+def benchmark(config, engines=('threads',), thread_counts=(32,),
+              parser='bs4', parse_workers=0, client_rate=10000.0):
+    """Runs every stage against a stand-in server for each engine and
+    thread count (the number of requests in flight, for the async engine).
+    Each run gets a fresh process, so peak RSS is measured per run"""
+    context = mp.get_context('spawn')
+    results = []
+
+    with StandInServer(config) as server:
+        for engine in engines:
+            if engine == 'async' and etl.aiohttp is None:
+                print('skipping the async engine - aiohttp is not installed')
+                continue
+
+            for threads in thread_counts:
+                # the stand-in server sets the pace, not the client
+                options = {'parser': parser, 'parse_workers': parse_workers,
+                           'rate': client_rate, 'max_rate': client_rate}
+                result_queue = context.Queue()
+                process = context.Process(target=_run_benchmark,
+                                          args=(server.url, engine, threads,
+                                                options, result_queue))
+                process.start()
+                try:
+                    run_results = _wait_for_results(process, result_queue)
+                finally:
+                    process.join()
+
+                for result in run_results:
+                    print(f'{result["engine"]:>7} | '
+                          f'{result["workers"]:>4} workers | '
+                          f'{result["stage"]:>6} | '
+                          f'{result["pages"]:>6} pages | '
+                          f'{result["pages_per_second"]:>8} pages/s | '
+                          f'p50 {result["p50_ms"]:>7} ms | '
+                          f'p99 {result["p99_ms"]:>7} ms | '
+                          f'peak RSS {result["peak_rss_mib"]} MiB')
+
+                results.extend(run_results)
+
+    return results
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--engines', nargs='+', default=['threads'],
+                        choices=etl.ENGINES)
+    parser.add_argument('--threads', nargs='+', type=int, default=[32])
+    parser.add_argument('--parser', default='bs4',
+                        choices=etl.PARSER_BACKENDS)
+    parser.add_argument('--parse-workers', type=int, default=0)
+    parser.add_argument('--bands-per-letter', type=int,
+                        default=BANDS_PER_LETTER)
+    parser.add_argument('--albums-per-band', type=int,
+                        default=ALBUMS_PER_BAND)
+    parser.add_argument('--tracks-per-album', type=int,
+                        default=TRACKS_PER_ALBUM)
+    parser.add_argument('--latency', type=float, default=LATENCY)
+    parser.add_argument('--latency-jitter', type=float,
+                        default=LATENCY_JITTER)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of responses that are 520s')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='share of responses that are 429s')
+    parser.add_argument('--max-pages-per-second', type=float,
+                        help='throughput cap of the server')
+    parser.add_argument('--replay-cache',
+                        help='serve pages recorded in a response cache '
+                             'instead of generated ones')
+    parser.add_argument('--json', help='also write the results here')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+
+    stand_in_config = StandInConfig(
+        bands_per_letter=args.bands_per_letter,
+        albums_per_band=args.albums_per_band,
+        tracks_per_album=args.tracks_per_album,
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        max_pages_per_second=args.max_pages_per_second,
+        replay_cache=args.replay_cache)
+
+    benchmark_results = benchmark(stand_in_config, args.engines, args.threads,
+                                  args.parser, args.parse_workers)
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(benchmark_results, json_file, indent=2)
@@ -1,41 +1,272 @@
 import re
 import sys
+import os
+import time
+import json
+import hashlib
+import tempfile
+import contextlib
 import multiprocessing as mp
+import concurrent.futures as cf
+import numpy as np
 import pandas as pd
-import itertools as it
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
 from decouple import config
-from queue import Queue
-from multiprocessing import Process
 
+import encyclopaedia_metallum_metrics as metrics
 
-USER = config('USER')
-PASSWORD = config('PASSWORD')
-IP_ADDRESS = config('IP_ADDRESS')
+try:
+    import pyarrow.dataset
+except ImportError:  # only required to load parquet output
+    pyarrow = None
+
+try:
+    import scipy.sparse
+except ImportError:  # only required to relate genres
+    scipy = None
+
+
+try:
+    import duckdb_engine
+except ImportError:  # only required by the duckdb backend
+    duckdb_engine = None
+
+
+BACKENDS = ('mysql', 'sqlite', 'duckdb')
+
+# the database the staging tables are written to. sqlite and duckdb are
+# embedded, so the pipeline can run without a server
+DB_BACKEND = config('DB_BACKEND', default='mysql')
+SQLITE_PATH = config('SQLITE_PATH', default='metallum.sqlite')
+DUCKDB_PATH = config('DUCKDB_PATH', default='metallum.duckdb')
 DATABASE = 'metallum'
 
+# the format the ETL wrote its output in, 'csv' or 'parquet'
+OUTPUT_FORMAT = config('OUTPUT_FORMAT', default='csv')
+
+# genre pairs shared by fewer bands than this aren't related
+GENRE_MIN_SUPPORT = config('GENRE_MIN_SUPPORT', default=1, cast=int)
+
+# pipeline metrics are snapshotted to METRICS_PATH.json and .prom
+METRICS_PATH = config('METRICS_PATH', default='db_metrics')
+
 THREAD_MAX = mp.cpu_count()
 
-conn_str = f'mysql+pymysql://{USER}:{PASSWORD}@{IP_ADDRESS}/{DATABASE}'
-mysql_conn = create_engine(conn_str)
+# mysql staging tables are bulk loaded with LOAD DATA LOCAL INFILE. if the
+# server doesn't allow it, rows are sent as multi-row INSERTs instead
+LOAD_DATA_LOCAL_INFILE = config('LOAD_DATA_LOCAL_INFILE', default=True,
+                                cast=bool)
+BULK_INSERT_ROWS = 10000
+TSV_CHUNK_ROWS = 100000
+
+# escape sequences understood by LOAD DATA's default field format
+TSV_ESCAPES = (('\\', '\\\\'), ('\0', '\\0'), ('\t', '\\t'),
+               ('\n', '\\n'), ('\r', '\\r'))
+
+# seconds a sqlite writer waits for another process to commit
+SQLITE_TIMEOUT = 600
+
+
+class Storage:
+    backend = DB_BACKEND
+    engine = None
+    use_load_data = LOAD_DATA_LOCAL_INFILE
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f'backend must be one of {BACKENDS}, '
+                         f'not {backend!r}')
+    if backend == 'duckdb' and duckdb_engine is None:
+        raise ImportError('the duckdb backend requires duckdb_engine')
+
+
+def _create_engine(backend):
+    if backend == 'sqlite':
+        return create_engine(f'sqlite:///{SQLITE_PATH}',
+                             connect_args={'timeout': SQLITE_TIMEOUT})
+
+    if backend == 'duckdb':
+        return create_engine(f'duckdb:///{DUCKDB_PATH}')
+
+    user = config('USER')
+    password = config('PASSWORD')
+    ip_address = config('IP_ADDRESS')
+    conn_str = f'mysql+pymysql://{user}:{password}@{ip_address}/{DATABASE}'
+    return create_engine(conn_str,
+                         connect_args={'local_infile':
+                                       LOAD_DATA_LOCAL_INFILE})
+
+
+def use_backend(backend):
+    """Switches the staging tables to another database"""
+    _check_backend(backend)
+
+    if Storage.engine is not None:
+        Storage.engine.dispose()
+
+    Storage.backend = backend
+    Storage.engine = None
+
+
+def _engine():
+    """The engine of the current backend, created on first use so that
+    each process of the pipeline connects on its own"""
+    if Storage.engine is None:
+        _check_backend(Storage.backend)
+        Storage.engine = _create_engine(Storage.backend)
+
+    return Storage.engine
+
+
+def _read_table(table):
+    return pd.read_sql(text(f'SELECT * FROM {table}'), _engine())
+
+
+def _read_output(name):
+    if OUTPUT_FORMAT == 'parquet':
+        return pd.read_parquet(f'{name}.parquet')
+    return pd.read_csv(f'{name}.csv')
+
+
+def _tsv_column(series):
+    """Formats a column the way LOAD DATA reads fields by default"""
+    if pd.api.types.is_bool_dtype(series):
+        series = series.astype('Int8')
+
+    is_null = series.isna()
+    values = series.astype(str)
+
+    if not pd.api.types.is_numeric_dtype(series):
+        for character, escaped in TSV_ESCAPES:
+            values = values.str.replace(character, escaped, regex=False)
+
+    return values.mask(is_null, r'\N')
+
+
+def _write_tsv(frame, file):
+    for start in range(0, len(frame), TSV_CHUNK_ROWS):
+        chunk = frame.iloc[start:start + TSV_CHUNK_ROWS]
+        columns = [_tsv_column(chunk[column]) for column in chunk.columns]
+
+        lines = columns[0]
+        if len(columns) > 1:
+            lines = lines.str.cat(columns[1:], sep='\t')
+
+        file.write('\n'.join(lines))
+        file.write('\n')
+
+
+@contextlib.contextmanager
+def _bulk_transaction():
+    """A single transaction with unique and foreign key checks off"""
+    with _engine().connect() as connection:
+        _set_bulk_checks(connection, False)
+        try:
+            with connection.begin():
+                yield connection
+        finally:
+            if not connection.invalidated:
+                _set_bulk_checks(connection, True)
+
+
+def _set_bulk_checks(connection, enabled):
+    # the session variables are set in a transaction of their own, as
+    # executing anything outside one autobegins a transaction that a later
+    # begin() refuses to nest in
+    value = int(enabled)
+    with connection.begin():
+        connection.execute(text(f'SET unique_checks = {value}, '
+                                f'foreign_key_checks = {value}'))
+
+
+def _load_data_infile(connection, frame, table):
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='',
+                                     suffix='.tsv', delete=False) as file:
+        _write_tsv(frame, file)
+
+    try:
+        path = file.name.replace('\\', '/')
+        columns = ', '.join(f'`{column}`' for column in frame.columns)
+        connection.execute(text(f"LOAD DATA LOCAL INFILE '{path}' "
+                                f"INTO TABLE `{table}` "
+                                f"CHARACTER SET utf8mb4 ({columns})"))
+    finally:
+        os.remove(file.name)
+
+
+def _mysql_insert(frame, table):
+    if Storage.use_load_data:
+        try:
+            with _bulk_transaction() as connection:
+                _load_data_infile(connection, frame, table)
+            return
+        except DBAPIError as exc:
+            print(f'LOAD DATA LOCAL INFILE failed ({exc.orig}), '
+                  'falling back to batched inserts')
+            Storage.use_load_data = False
+
+    with _bulk_transaction() as connection:
+        frame.to_sql(table, connection, if_exists='append', index=False,
+                     method='multi', chunksize=BULK_INSERT_ROWS)
+
+
+def _sqlite_insert(frame, table):
+    # one executemany per chunk, all in a single transaction
+    with _engine().begin() as connection:
+        frame.to_sql(table, connection, if_exists='append', index=False,
+                     chunksize=BULK_INSERT_ROWS)
+
+
+def _duckdb_insert(frame, table):
+    # duckdb scans the frame in place rather than binding rows one by one
+    with _engine().begin() as connection:
+        view = f'{table}_frame'
+        connection.connection.register(view, frame)
+        try:
+            connection.execute(text(f'INSERT INTO {table} '
+                                    f'SELECT * FROM {view}'))
+        finally:
+            connection.connection.unregister(view)
+
+
+_BULK_INSERTS = {'mysql': _mysql_insert,
+                 'sqlite': _sqlite_insert,
+                 'duckdb': _duckdb_insert}
+
+
+def _bulk_load(df, table, if_exists='replace'):
+    """Writes a frame and its index to a staging table. The table is
+    created without indexes, apply_indexes adds them after loading"""
+    frame = df.reset_index()
+    frame.head(0).to_sql(table, _engine(), if_exists=if_exists, index=False)
+
+    if frame.empty:
+        return
+
+    with metrics.registry.timer('db_load_seconds', table=table):
+        _BULK_INSERTS[Storage.backend](frame, table)
+
+    metrics.registry.count('db_rows_loaded_total', len(frame), table=table)
 
 
 def load_bands():
     print('loading bands...')
-    bands_df = pd.read_csv('bands.csv')
+    bands_df = _read_output('bands')
     bands_df.columns = ('metallum_band_id', 'band_name', 'genre', 'country',
                         'band_status', 'band_url')
 
     bands_df.index.name = 'stg_band_id'
     bands_df = bands_df.drop_duplicates()
     bands_df = bands_df.convert_dtypes()
-    bands_df.to_sql('stg_bands', mysql_conn, if_exists='replace')
+    _bulk_load(bands_df, 'stg_bands')
 
 
 def load_albums():
     print('loading albums...')
-    albums_df = pd.read_csv('albums.csv')
+    albums_df = _read_output('albums')
     albums_df.columns = ('metallum_band_id', 'band_name', 'metallum_album_id',
                          'album_name', 'album_type', 'year', 'review',
                          'album_url')
@@ -43,388 +274,601 @@ def load_albums():
     albums_df.index.name = 'stg_album_id'
     albums_df = albums_df.drop_duplicates()
     albums_df = albums_df.convert_dtypes()
-    albums_df.to_sql('stg_albums', mysql_conn, if_exists='replace')
+    _bulk_load(albums_df, 'stg_albums')
 
 
 def load_countries():
     print('loading countries...')
-    bands_df = pd.read_sql('stg_bands', mysql_conn)
+    bands_df = _read_table('stg_bands')
     unique_countries = bands_df['country'].unique()
     unique_countries.sort()
     country_df = pd.DataFrame(unique_countries, columns=['country_name'])
     country_df.index.name = 'stg_country_id'
-    country_df.to_sql('stg_countries', mysql_conn, if_exists='replace')
+    _bulk_load(country_df, 'stg_countries')
 
 
 def load_genres():
     print('loading genres...')
-    band_genres_df = pd.read_sql('stg_band_genres', mysql_conn)
+    band_genres_df = _read_table('stg_band_genres')
     unique_genres = band_genres_df['genre_name'].unique()
     unique_genres.sort()
     genre_df = pd.DataFrame(unique_genres, columns=['genre_name'])
     genre_df.index.name = 'stg_genre_id'
-    genre_df.to_sql('stg_genres', mysql_conn, if_exists='replace')
-
-
-def load_tracks():
-    print('loading tracks...')
-
-    def _track_generator(page_size):
-        file = open('tracks.csv', 'r', encoding='utf-8')
-
-        line = file.readline()
-        columns = line.strip().split(',')
+    _bulk_load(genre_df, 'stg_genres')
 
-        row_count = 0
-        for _ in file:
-            row_count += 1
 
-        file.close()
+TRACK_DTYPES = {'metallum_band_id': 'int64', 'metallum_album_id': 'int64',
+                'track_number': 'int32'}
+TRACK_PAGE_SIZE = 100000
 
-        max_index = 0
 
-        while max_index < row_count:
-            kwargs = {'skiprows': max_index + 1, 'nrows': page_size}
-            page_df = pd.read_csv('tracks.csv', **kwargs)
-            if page_df.empty:
-                break
+def _read_track_pages(page_size=TRACK_PAGE_SIZE, output_format=None):
+    """Yields the tracks in pages of typed rows, numbered by stg_track_id"""
+    output_format = output_format or OUTPUT_FORMAT
 
-            page_df.columns = columns
+    if output_format == 'parquet':
+        if pyarrow is None:
+            raise ImportError('loading parquet output requires pyarrow')
 
-            page_df.index.name = 'stg_track_id'
+        # tracks.parquet is a directory with one file per checkpoint
+        dataset = pyarrow.dataset.dataset('tracks.parquet', format='parquet')
+        pages = (batch.to_pandas()
+                 for batch in dataset.to_batches(batch_size=page_size))
+    else:
+        # a single pass over the file, parsed one chunk at a time
+        pages = pd.read_csv('tracks.csv', dtype=TRACK_DTYPES,
+                            chunksize=page_size)
 
-            page_df.index = page_df.index + max_index
-
-            page_df['metallum_band_id'] = \
-                page_df['metallum_band_id'].astype('int64')
+    max_index = 0
+    for page_df in pages:
+        if page_df.empty:
+            continue
 
-            page_df['metallum_album_id'] = \
-                page_df['metallum_album_id'].astype('int64')
+        page_df.index = pd.RangeIndex(max_index, max_index + len(page_df),
+                                      name='stg_track_id')
+        page_df = page_df.astype(TRACK_DTYPES)
 
-            page_df['track_number'] = \
-                page_df['track_number'].astype('int32')
+        yield page_df
 
-            yield page_df
+        max_index += len(page_df)
 
-            max_index = max(page_df.index) + 1
 
-    track_gen = _track_generator(100000)
+def load_tracks():
+    print('loading tracks...')
+    track_gen = _read_track_pages()
 
     initial_load = next(track_gen)
-    initial_load.to_sql('stg_tracks', mysql_conn, if_exists='replace')
+    _bulk_load(initial_load, 'stg_tracks')
 
     for track_page in track_gen:
-        track_page.to_sql('stg_tracks', mysql_conn, if_exists='append')
-
-
-def clean_genre(genre):
-    genre = genre.strip()
-
-    # normalize and removes spaces from common patterns
-    genre = re.sub(r' \'?n\'? ', '\'n\'', genre)
-    genre = re.sub(r'nu ', 'nu-', genre)
-    genre = re.sub(r'new ', 'new-', genre)
-    genre = re.sub(r'hard ', 'hard-', genre)
-    genre = re.sub(r'free ', 'free-', genre)
-    genre = re.sub(r'post ', 'post-', genre)
-    genre = re.sub(r'jazzy', 'jazz', genre)
-    genre = re.sub(r'pop rock', 'pop-rock', genre)
-    genre = re.sub(r'trip hop', 'trip-hop', genre)
-    genre = re.sub(r'cloud rap', 'cloud-rap', genre)
-    genre = re.sub(r'a cappella', 'a-cappela', genre)
-    genre = re.sub(r'bossa nova', 'bossa-nova', genre)
-    genre = re.sub(r'spoken word', 'spoken-word', genre)
-    genre = re.sub(r'film score', 'film-score', genre)
-    genre = re.sub(r'world music', 'world-music', genre)
-    genre = re.sub(r'middle eastern', 'middle-eastern', genre)
-    genre = re.sub(r'ethnic music', 'ethnic-music', genre)
-    genre = re.sub(r'game music', 'game-music', genre)
-    genre = re.sub(r'drum and bass', 'drum-and-bass', genre)
-    genre = re.sub(r'psychedellic rock', 'psychedellic-rock', genre)
-    genre = re.sub(r'power electronics', 'power-electronics', genre)
-    genre = re.sub(r'neue deutsche härte', 'neue-deutsche-härte', genre)
-
+        _bulk_load(track_page, 'stg_tracks', if_exists='append')
+
+
+# the rules that clean a genre, shared by clean_genre and clean_genres.
+# first, substitutions made in this order, which normalize and remove
+# spaces from common patterns
+GENRE_REPLACEMENTS = tuple((re.compile(pattern), replacement)
+                           for pattern, replacement in (
+    (r' \'?n\'? ', '\'n\''),
+    (r'nu ', 'nu-'),
+    (r'new ', 'new-'),
+    (r'hard ', 'hard-'),
+    (r'free ', 'free-'),
+    (r'post ', 'post-'),
+    (r'jazzy', 'jazz'),
+    (r'pop rock', 'pop-rock'),
+    (r'trip hop', 'trip-hop'),
+    (r'cloud rap', 'cloud-rap'),
+    (r'a cappella', 'a-cappela'),
+    (r'bossa nova', 'bossa-nova'),
+    (r'spoken word', 'spoken-word'),
+    (r'film score', 'film-score'),
+    (r'world music', 'world-music'),
+    (r'middle eastern', 'middle-eastern'),
+    (r'ethnic music', 'ethnic-music'),
+    (r'game music', 'game-music'),
+    (r'drum and bass', 'drum-and-bass'),
+    (r'psychedellic rock', 'psychedellic-rock'),
+    (r'power electronics', 'power-electronics'),
+    (r'neue deutsche härte', 'neue-deutsche-härte'),
     # convert genre fusions into multiple genres
-    genre = re.sub(r'deathgrind', 'death grind', genre)
+    (r'deathgrind', 'death grind'),
+    # eg "grindcore" -> "grind hardcore", which turns "hardcore" into
+    # "hard hardcore"
+    (r'(\S+)core', r'\g<1> hardcore'),
+    (r'hard hardcore', 'hardcore'),
+    # turn "genre'n'roll" into "genre rock'n'roll"
+    (r'(\S+)\'n\'roll', r"\g<1> rock'n'roll"),
+))
 
-    # handle "core" genres
-    # eg "grindcore" -> "grind hardcore"
-    genre = re.sub(r'(\S+)core', r'\g<1> hardcore')
+# then the genre is split on each of these, spaces last
+GENRE_SEPARATORS = (' with ', ' and ', '/', ' ')
 
-    # the above will turn "hardcore" into "hard hardcore"
-    genre = re.sub(r'hard hardcore', 'hardcore')
+# and every part is cleaned up. oddballs are lumped into their closest
+# relatives, and junk is dropped
+GENRE_ODDBALLS = {'post': 'post-metal', 'hard': 'hard-rock',
+                  'soft': 'soft-rock', 'electronics': 'power-electronics',
+                  'atmoshpheric': 'atmospheric', 'world': 'world-music'}
+GENRE_JUNK = ('', 'metal', 'elements', 'influences', 'music')
 
-    # turn "genre'n'roll" into "genre rock'n'roll"
-    genre = re.sub(r'(\S+)\'n\'roll', r"\g<1> rock'n'roll", genre)
 
-    genres = genre.split(' with ')
-    genres = list(set().union(*[g.split(' and ') for g in genres]))
-    genres = list(set().union(*[g.split('/') for g in genres]))
+def clean_genre(genre):
+    """Returns the clean genres of a single genre string"""
+    genre = genre.strip()
+    for pattern, replacement in GENRE_REPLACEMENTS:
+        genre = pattern.sub(replacement, genre)
 
-    # finally, spaces
-    genres = list(set().union(*[g.split(' ') for g in genres]))
+    genres = {genre}
+    for separator in GENRE_SEPARATORS:
+        genres = set().union(*[g.split(separator) for g in genres])
 
     # final clean-up
     clean_genres = list()
-    junk = ('', 'metal', 'elements', 'influences', 'music')
     for genre in genres:
         genre = genre.strip()
 
         if genre.endswith('-'):
             genre += 'metal'
 
-        # lump oddballs into their closest relatives
-        if genre == 'post':
-            genre = 'post-metal'
+        genre = GENRE_ODDBALLS.get(genre, genre)
 
-        if genre == 'hard':
-            genre = 'hard-rock'
+        if genre in GENRE_JUNK:
+            continue
 
-        if genre == 'soft':
-            genre = 'soft-rock'
+        clean_genres.append(genre)
 
-        if genre == 'electronics':
-            genre = 'power-electronics'
+    return clean_genres
 
-        if genre == 'atmoshpheric':
-            genre = 'atmospheric'
 
-        if genre == 'world':
-            genre = 'world-music'
+# splits a band's genre on commas that aren't within parentheses
+GENRE_LIST_PATTERN = re.compile(r'(?!\B\([^\)]*),(?![^\(]*\)\B)')
 
-        if genre in junk:
-            continue
+# scrubs details that break the patterns used to split and clean genres
+GENRE_SCRUBS = tuple((re.compile(pattern), replacement)
+                     for pattern, replacement in (
+    (r'\u200b', ''),
+    # somebody left a cyrillic c in one of the RAC entries
+    (chr(1089), chr(99)),
+    (r'(\w)\(', r'\g<1> ('),
+    (r'\)\/? ', r'); '),
+    (r' \- ', ' '),
+))
 
-        clean_genres.append(genre)
+GENRE_PHASES = ('later', 'early', 'mid')
+PHASE_PATTERN = re.compile(r' \((.+)\)$')
 
-    return clean_genres
+# parsed genres are cached here by raw genre string. the cache is dropped
+# whenever the rules above change, or when GENRE_RULES_REVISION is bumped
+# after a change to the parsing code itself
+GENRE_CACHE = config('GENRE_CACHE', default='genre_cache.json')
+GENRE_RULES_REVISION = 1
 
 
-def process_band_genres():
-    print('processing band genres...')
-    bands_df = pd.read_sql('stg_bands', mysql_conn)
-    selection = ['stg_band_id', 'genre']
-    genre_df = bands_df[selection]
-    genre_df.columns = ('stg_band_id', 'genre')
-    genre_df = genre_df.set_index('stg_band_id')
+def _replace_all(strings, replacements):
+    for pattern, replacement in replacements:
+        strings = strings.str.replace(pattern, replacement, regex=True)
+    return strings
+
+
+def clean_genres(genres):
+    """A vectorized clean_genre. Returns the clean genres of a Series of
+    genre strings, one per row, indexed like the string they came from.
+    Each distinct string is only cleaned once"""
+    codes, unique_genres = pd.factorize(genres)
+
+    clean = _replace_all(pd.Series(unique_genres).str.strip(),
+                         GENRE_REPLACEMENTS)
+    for separator in GENRE_SEPARATORS:
+        clean = clean.str.split(separator, regex=False).explode()
+
+    clean = clean.str.strip()
+    clean = clean.mask(clean.str.endswith('-'), clean + 'metal')
+    clean = clean.replace(GENRE_ODDBALLS)
+    clean = clean[~clean.isin(GENRE_JUNK)]
+
+    clean_df = pd.DataFrame({'code': clean.index, 'genre_name': clean.values})
+    clean_df = clean_df.drop_duplicates()
+
+    rows_df = pd.DataFrame({'row': range(len(codes)), 'code': codes})
+    rows_df = rows_df.merge(clean_df, on='code')
+    rows_df = rows_df.sort_values('row', kind='stable')
+
+    return pd.Series(rows_df['genre_name'].values,
+                     index=genres.index[rows_df['row'].values],
+                     name='genre_name')
+
+
+def check_genre_parity(genres):
+    """Runs clean_genre and clean_genres over a Series of genre strings and
+    returns the strings they disagree on. Both apply the same rules, so
+    this checks the vectorized splitting and clean-up"""
+    genres = pd.Series(genres.unique())
+    clean_sets = clean_genres(genres).groupby(level=0).agg(set)
+
+    mismatched_genres = []
+    for position, genre in genres.items():
+        expected = set(clean_genre(genre))
+        if expected != clean_sets.get(position, set()):
+            mismatched_genres.append(genre)
+
+    print(f'genre parity | {len(genres)} genres checked, '
+          f'{len(mismatched_genres)} mismatched')
+
+    return mismatched_genres
+
+
+def _parse_genres(genres):
+    """Splits a Series of raw genre strings into clean genres and phases.
+    Returns a frame of genre_name and phase_name, indexed like the strings
+    they came from"""
+    genres = genres.rename_axis('genre_id')
 
     # (first pass)
     # split genres by commas that aren't contained
     # with parentheses. At the same time,
     # scrub anomalous details that causes genres
     # to fall out of common patterns or break grouping
-    unpivoted_genre_phases = list()
-    for band_index, row in genre_df.iterrows():
-        genres = re.split(r'(?!\B\([^\)]*),(?![^\(]*\)\B)', row['genre'])
-
-        for genre in genres:
-            genre = genre.lower()
-
-            genre = re.sub(r'\u200b', '', genre)
-
-            # somebody left a cyrillic c in one of the RAC entries
-            genre = re.sub(chr(1089), chr(99), genre)
-            genre = re.sub(r'(\w)\(', r'\g<1> (', genre)
-            genre = re.sub(r'\)\/? ', r'); ', genre)
-            genre = re.sub(r' \- ', ' ', genre)
-            phases = genre.split(';')
-            for phase in phases:
-                record = (band_index, phase)
-                unpivoted_genre_phases.append(record)
+    genres = genres.str.split(GENRE_LIST_PATTERN, regex=True).explode()
+    genres = _replace_all(genres.str.lower(), GENRE_SCRUBS)
+    genre_phases = genres.str.split(';', regex=False).explode()
+    records_df = genre_phases.rename('genre').reset_index()
 
     # (second pass)
     # parse phases into a separate column
     # e.g. thrash metal (early) power metal (later)
-    desired_phases = ('later', 'early', 'mid')
-    processed_genre_phases = list()
-    for band_index, p in unpivoted_genre_phases:
-        phase_match = re.search(r' \(.+\)$', p)
-        if phase_match:
-            phase_text = phase_match.group(0)
-            genre = p.replace(phase_text, '')
-            cleaned_phases = phase_text.lstrip()[1:-1]
-            split_phases = re.split(r'[,\/\\]', cleaned_phases)
+    phase_text = records_df['genre'].str.extract(PHASE_PATTERN, expand=False)
+    phases = phase_text.str.split(r'[,\/\\]', regex=True).explode()
+    phases = phases.str.strip()
 
-            records = set()
-            for phase in split_phases:
-                phase = phase.strip()
+    # filter phases that don't adhere to the discrete
+    # categories 'early', 'mid', and 'later'
+    phases = phases.where(phases.isin(GENRE_PHASES), None)
 
-                # filter phases that don't adhere to the discrete
-                # categories 'early', 'mid', and 'later'
-                phase = phase if phase in desired_phases else None
-                records.add((band_index, genre, phase))
+    records_df['genre'] = \
+        records_df['genre'].str.replace(PHASE_PATTERN, '', regex=True)
+    records_df = records_df.join(phases.rename('phase_name'))
+    records_df = records_df.drop_duplicates().reset_index(drop=True)
 
-            records = list(records)
+    # (third pass)
+    # fix data issues
+    clean = clean_genres(records_df['genre'])
+    parsed_df = records_df.join(clean, how='inner')
+    parsed_df = parsed_df.set_index('genre_id')
 
-        else:
-            genre = p
-            records = [(band_index, genre, None)]
+    return parsed_df[['genre_name', 'phase_name']]
 
-        processed_genre_phases += records
 
-    # (third pass)
-    # fix data issues
-    cleaned_records = list()
-    for band_index, genre, phase in processed_genre_phases:
-        genres = clean_genre(genre)
-        cleaned_records += [(band_index, g, phase) for g in genres]
+def _genre_rules_version():
+    """A hash of every rule used to parse genres"""
+    rules = (GENRE_RULES_REVISION,
+             GENRE_LIST_PATTERN.pattern,
+             [(pattern.pattern, repl) for pattern, repl in GENRE_SCRUBS],
+             PHASE_PATTERN.pattern,
+             GENRE_PHASES,
+             [(pattern.pattern, repl) for pattern, repl in GENRE_REPLACEMENTS],
+             GENRE_SEPARATORS,
+             GENRE_ODDBALLS,
+             GENRE_JUNK)
+
+    rules_json = json.dumps(rules, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(rules_json.encode('utf-8')).hexdigest()
+
+
+def _load_genre_cache(version):
+    try:
+        with open(GENRE_CACHE, 'r', encoding='utf-8') as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-    cleaned_genres_df = pd.DataFrame(cleaned_records)
-    cleaned_genres_df.columns = ('stg_band_id', 'genre_name', 'phase_name')
+    if cache.get('version') != version:
+        print('genre rules have changed - discarding the genre cache')
+        return {}
+
+    return cache['genres']
+
+
+def _save_genre_cache(version, genres):
+    with open(f'{GENRE_CACHE}.tmp', 'w', encoding='utf-8') as cache_file:
+        json.dump({'version': version, 'genres': genres}, cache_file,
+                  ensure_ascii=False)
+    os.replace(f'{GENRE_CACHE}.tmp', GENRE_CACHE)
+
+
+def _band_genres(bands_df, genre_cache):
+    """Returns the clean genres and phases of each band. Raw genre strings
+    missing from genre_cache are parsed and added to it"""
+    raw_genres = pd.Series(bands_df['genre'].unique())
+    new_genres = raw_genres[~raw_genres.isin(list(genre_cache))]
+    print(f'{len(new_genres)} of {len(raw_genres)} distinct genres '
+          'need parsing')
+
+    if not new_genres.empty:
+        parsed_df = _parse_genres(new_genres)
+
+        for genre in new_genres:
+            genre_cache[genre] = []
+
+        parsed_records = zip(parsed_df.index, parsed_df['genre_name'],
+                             parsed_df['phase_name'])
+        for position, genre_name, phase_name in parsed_records:
+            phase_name = phase_name if pd.notna(phase_name) else None
+            genre_cache[new_genres[position]].append([genre_name,
+                                                      phase_name])
+
+    cached_records = [(genre, genre_name, phase_name)
+                      for genre in raw_genres
+                      for genre_name, phase_name in genre_cache[genre]]
+    cached_df = pd.DataFrame(cached_records,
+                             columns=('genre', 'genre_name', 'phase_name'))
+
+    cleaned_genres_df = bands_df[['stg_band_id', 'genre']].merge(cached_df,
+                                                                 on='genre')
+
+    selection = ['stg_band_id', 'genre_name', 'phase_name']
+    cleaned_genres_df = cleaned_genres_df[selection]
     cleaned_genres_df.index.name = 'stg_band_genre_id'
     cleaned_genres_df = cleaned_genres_df.drop_duplicates()
-    cleaned_genres_df = cleaned_genres_df.convert_dtypes()
-    cleaned_genres_df.to_sql('stg_band_genres', mysql_conn,
-                             if_exists='replace')
+    return cleaned_genres_df.convert_dtypes()
+
+
+def process_band_genres():
+    print('processing band genres...')
+    bands_df = _read_table('stg_bands')
+
+    # raw genre strings are parsed once, then remembered between runs
+    version = _genre_rules_version()
+    genre_cache = _load_genre_cache(version)
+    cached_genre_count = len(genre_cache)
+
+    cleaned_genres_df = _band_genres(bands_df, genre_cache)
+
+    if len(genre_cache) != cached_genre_count:
+        _save_genre_cache(version, genre_cache)
+
+    _bulk_load(cleaned_genres_df, 'stg_band_genres')
+
+
+def _band_genre_phases(genre_df):
+    """Flags which of a band's genres it played in its early, mid and later
+    phases. Genres without a phase belong to every phase"""
+    phase_names = genre_df['phase_name']
+    has_null_phases = phase_names.isna()
+
+    genre_phase_df = pd.DataFrame({
+        'stg_band_id': genre_df['stg_band_id'],
+        'genre_name': genre_df['genre_name'],
+        'early_phase': has_null_phases | (phase_names == 'early'),
+        'mid_phase': has_null_phases | (phase_names == 'mid'),
+        'later_phase': has_null_phases | (phase_names == 'later')
+    })
+
+    genre_phase_df = genre_phase_df.groupby(['stg_band_id', 'genre_name'],
+                                            as_index=False).any()
+    genre_phase_df.index.name = 'stg_band_genre_phase_id'
+    return genre_phase_df.convert_dtypes()
 
 
 def process_band_genre_changes():
     print('processing genre changes...')
-    genre_df = pd.read_sql('stg_band_genres', mysql_conn)
+    genre_df = _read_table('stg_band_genres')
 
-    genre_phase_records = []
+    genre_phase_df = _band_genre_phases(genre_df)
+    _bulk_load(genre_phase_df, 'stg_band_genre_phases')
 
-    band_ids = genre_df['stg_band_id'].unique()
-    for band_id in band_ids:
-        band_records = genre_df[genre_df['stg_band_id'] == band_id]
+    return genre_phase_df
 
-        has_null_phases = pd.isnull(band_records['phase_name'])
-        core_genre_records = band_records[has_null_phases]
-        core_genres = list(core_genre_records['genre_name'].unique())
 
-        is_early_phase = band_records['phase_name'] == 'early'
-        is_mid_phase = band_records['phase_name'] == 'mid'
-        is_later_phase = band_records['phase_name'] == 'later'
+def _genre_cooccurrence(band_genres_df, min_support=1):
+    """Counts the bands that have each pair of genres, using a sparse
+    band by genre incidence matrix G. The counts are the off-diagonal
+    entries of G.T @ G, so memory grows with the number of distinct genre
+    pairs rather than with the number of pairs across bands"""
+    if scipy is None:
+        raise ImportError('relating genres requires scipy')
 
-        early_genres = \
-            list((band_records[is_early_phase])['genre_name'].unique())
-        mid_genres = \
-            list((band_records[is_mid_phase])['genre_name'].unique())
-        later_genres = \
-            list((band_records[is_later_phase])['genre_name'].unique())
+    band_codes, band_ids = pd.factorize(band_genres_df['stg_band_id'])
+    genre_codes, genre_ids = pd.factorize(band_genres_df['stg_genre_id'])
 
-        record = (band_id, core_genres + early_genres,
-                  core_genres + mid_genres, core_genres + later_genres)
+    ones = np.ones(len(band_codes), dtype='int32')
+    incidence = scipy.sparse.csr_matrix((ones, (band_codes, genre_codes)),
+                                        shape=(len(band_ids), len(genre_ids)))
 
-        genre_phase_records.append(record)
+    # a band with a genre in several phases still has it once
+    incidence.data[:] = 1
 
-    genre_phase_df = pd.DataFrame(genre_phase_records)
-    genre_phase_df = genre_phase_df.drop_duplicates()
-    genre_phase_df.columns = ('stg_band_id', 'early_phase', 'mid_phase',
-                              'later_phase')
+    cooccurrence = (incidence.T @ incidence).tocoo()
+    is_edge = (cooccurrence.row != cooccurrence.col) & \
+        (cooccurrence.data >= min_support)
 
+    edges_df = pd.DataFrame({
+        'stg_genre_id': genre_ids[cooccurrence.row[is_edge]],
+        'related_stg_genre_id': genre_ids[cooccurrence.col[is_edge]],
+        'band_count': cooccurrence.data[is_edge]
+    })
 
-def process_genre_relationships():
-    band_genres_df = pd.read_sql('SELECT * FROM band_genres_vw', mysql_conn)
+    return edges_df.sort_values(['stg_genre_id', 'related_stg_genre_id'],
+                                ignore_index=True)
 
-    genre_permutations = list()
-    band_ids = band_genres_df['stg_band_id'].unique()
-    for band_id in band_ids:
-        genres_df = band_genres_df[band_genres_df['stg_band_id'] == band_id]
-        genre_relationships = \
-            list(it.permutations(genres_df['stg_genre_id'], 2))
-        genre_permutations += genre_relationships
 
-    genre_permutations_cols = ('stg_genre_id', 'related_stg_genre_id')
-    genre_permutations_df = \
-        pd.DataFrame(genre_permutations, columns=genre_permutations_cols)
+def _genre_relationships(band_genres_df, min_support=1):
+    """Returns the weighted genre combinations and permutations"""
+    genre_permutations_df = _genre_cooccurrence(band_genres_df, min_support)
     genre_permutations_df.index.name = 'stg_genre_permutation_id'
 
-    genre_combos = list()
-    band_ids = band_genres_df['stg_band_id'].unique()
-    for band_id in band_ids:
-        genres_df = band_genres_df[band_genres_df['stg_band_id'] == band_id]
-        genre_relationships = \
-            list(it.combinations(genres_df['stg_genre_id'], 2))
-        genre_combos += genre_relationships
-
-    genre_combos_cols = ('stg_genre_id', 'related_stg_genre_id')
-    genre_combos_df = \
-        pd.DataFrame(genre_combos, columns=genre_combos_cols)
+    # every pair appears both ways round, combinations keep one of them
+    is_combination = genre_permutations_df['stg_genre_id'] < \
+        genre_permutations_df['related_stg_genre_id']
+    genre_combos_df = genre_permutations_df[is_combination]
+    genre_combos_df = genre_combos_df.reset_index(drop=True)
     genre_combos_df.index.name = 'stg_genre_combination_id'
 
-    genre_combos_df.to_sql('stg_genre_combos', mysql_conn,
-                           if_exists='replace')
-    genre_permutations_df.to_sql('stg_genre_permutations', mysql_conn,
-                                 if_exists='replace')
+    return genre_combos_df, genre_permutations_df
+
+
+# band genres joined to their genre ids, in sql every backend understands
+BAND_GENRE_IDS_QUERY = '''
+SELECT bg.stg_band_id, g.stg_genre_id
+FROM stg_band_genres AS bg
+INNER JOIN stg_genres AS g
+    ON bg.genre_name = g.genre_name
+'''
+
+
+def process_genre_relationships(min_support=GENRE_MIN_SUPPORT):
+    print('processing genre relationships...')
+    band_genres_df = pd.read_sql(text(BAND_GENRE_IDS_QUERY), _engine())
+
+    genre_combos_df, genre_permutations_df = \
+        _genre_relationships(band_genres_df, min_support)
+
+    _bulk_load(genre_combos_df, 'stg_genre_combos')
+    _bulk_load(genre_permutations_df, 'stg_genre_permutations')
+
+
+# index column prefix lengths, which only mysql needs for text columns
+PREFIX_LENGTH_PATTERN = re.compile(r'\s*\(\d+\)')
 
 
 def apply_indexes():
     with open('encyclopaedia_metallum_db.sql', 'r') as sql:
         sql_text = sql.read()
-        clean_sql_text = sql_text.replace('\n', ' ')
-        sql_statements = [s + ';' for s in clean_sql_text.split(';')
-                          if s.strip() != '']
-        for statement in sql_statements:
-            mysql_conn.execute(statement)
-
 
-def process_concurrently(*args):
-    still_threading = True
+    clean_sql_text = sql_text.replace('\n', ' ')
+    sql_statements = [s.strip() for s in clean_sql_text.split(';')
+                      if s.strip() != '']
 
-    def _process_funcs_concurrently():
-        while still_threading:
-            thread_func = q.get()
-            if thread_func:
-                thread_func()
-            q.task_done()
-
-    q = Queue(THREAD_MAX * 2)
-    for _ in range(THREAD_MAX):
-        process = Process(target=_process_funcs_concurrently)
-        process.daemon = True
-        process.start()
+    with _engine().begin() as connection:
+        for statement in sql_statements:
+            if Storage.backend != 'mysql':
+                statement = PREFIX_LENGTH_PATTERN.sub('', statement)
+            connection.execute(text(statement))
+
+
+# every step of process_data, along with the tables it reads and the tables
+# it writes. a step runs as soon as all of the tables it reads are written
+PIPELINE = (
+    (load_bands, (), ('stg_bands',)),
+    (load_albums, (), ('stg_albums',)),
+    (load_tracks, (), ('stg_tracks',)),
+    (load_countries, ('stg_bands',), ('stg_countries',)),
+    (process_band_genres, ('stg_bands',), ('stg_band_genres',)),
+    (load_genres, ('stg_band_genres',), ('stg_genres',)),
+    (process_band_genre_changes, ('stg_band_genres',),
+     ('stg_band_genre_phases',)),
+    (process_genre_relationships, ('stg_band_genres', 'stg_genres'),
+     ('stg_genre_combos', 'stg_genre_permutations')),
+    (apply_indexes, ('stg_albums', 'stg_band_genres', 'stg_bands',
+                     'stg_countries', 'stg_tracks', 'stg_genres',
+                     'stg_genre_combos', 'stg_genre_permutations',
+                     'stg_band_genre_phases'), ()),
+)
+
+
+def _run_step(step_func, backend):
+    """Runs a step in a pool process, returning how long it took along with
+    the metrics it recorded"""
+    if backend != Storage.backend:
+        use_backend(backend)
+
+    metrics.registry.reset()
+
+    start = time.perf_counter()
+    step_func()
+    return time.perf_counter() - start, metrics.registry.state()
+
+
+def _check_pipeline(pipeline):
+    written_tables = set()
+    for _, _, output_tables in pipeline:
+        written_tables.update(output_tables)
+
+    for step_func, input_tables, _ in pipeline:
+        missing_tables = set(input_tables) - written_tables
+        if missing_tables:
+            msg = (f'{step_func.__name__} reads {sorted(missing_tables)}, '
+                   'which no step writes')
+            raise ValueError(msg)
+
+
+def process_data(pipeline=PIPELINE, workers=THREAD_MAX, backend=None,
+                 metrics_path=METRICS_PATH):
+    """Runs every step of the pipeline in a pool of processes, starting each
+    step once the tables it reads have been written. The backend defaults
+    to DB_BACKEND. Metrics are snapshotted to metrics_path.json and
+    metrics_path.prom"""
+    backend = backend or Storage.backend
+    _check_backend(backend)
+    _check_pipeline(pipeline)
+
+    # a duckdb file can only be opened by one process at a time
+    if backend == 'duckdb':
+        workers = 1
+
+    snapshots = contextlib.nullcontext()
+    if metrics_path is not None:
+        snapshots = metrics.SnapshotWriter(metrics.registry, metrics_path)
+
+    with snapshots:
+        _schedule_steps(pipeline, workers, backend)
+
+
+def _schedule_steps(pipeline, workers, backend):
+    pipeline_start = time.perf_counter()
+    written_tables = set()
+    waiting_steps = list(pipeline)
+    running_steps = {}
+
+    progress = metrics.registry.progress('db', len(pipeline))
+    executor = cf.ProcessPoolExecutor(workers)
 
     try:
-        for func in args:
-            q.put(func)
-        q.join()
+        while waiting_steps or running_steps:
+            for step in list(waiting_steps):
+                step_func, input_tables, _ = step
+                if written_tables.issuperset(input_tables):
+                    waiting_steps.remove(step)
+                    future = executor.submit(_run_step, step_func,
+                                             backend)
+                    running_steps[future] = step
+
+            if not running_steps:
+                names = [step_func.__name__ for step_func, _, _ in
+                         waiting_steps]
+                raise ValueError(f'steps {names} depend on each other')
+
+            metrics.registry.gauge('db_running_steps', len(running_steps))
+
+            finished, _ = cf.wait(running_steps,
+                                  return_when=cf.FIRST_COMPLETED)
+
+            for future in finished:
+                step_func, _, output_tables = running_steps.pop(future)
+                elapsed, step_metrics = future.result()
+
+                metrics.registry.merge(step_metrics)
+                metrics.registry.observe('db_step_seconds', elapsed,
+                                         step=step_func.__name__)
+                metrics.registry.advance('db')
+
+                eta = metrics.format_duration(progress.eta())
+                print(f'{step_func.__name__} finished in {elapsed:.2f}s '
+                      f'({progress.done} of {progress.total} steps, '
+                      f'ETA {eta})')
+                written_tables.update(output_tables)
+
     except KeyboardInterrupt:
-        still_threading = False
-        for _ in range(THREAD_MAX):
-            q.put(None)
+        executor.shutdown(wait=False, cancel_futures=True)
         sys.exit(1)
+    except Exception:
+        executor.shutdown(wait=False, cancel_futures=True)
         raise
 
-    still_threading = False
-    for _ in range(THREAD_MAX):
-        q.put(None)
-
-
-def process_data():
-    initial_load = [
-        load_bands,
-        load_albums,
-        load_tracks
-    ]
-
-    process_countries_and_band_genres = [
-        load_countries,
-        process_band_genres
-    ]
-
-    process_genres = [
-        load_genres,
-    ]
-
-    process_genre_permutations = [
-        process_genre_relationships
-    ]
-
-    post_deployment = [
-        apply_indexes
-    ]
-
-    pipline = [
-        initial_load,
-        process_countries_and_band_genres,
-        process_genres,
-        process_genre_permutations,
-        post_deployment
-    ]
-
-    for step in pipline:
-        process_concurrently(*step)
+    executor.shutdown()
+    metrics.registry.gauge('db_running_steps', 0)
+
+    elapsed = time.perf_counter() - pipeline_start
+    print(f'pipeline finished in {elapsed:.2f}s')
 
 
 if __name__ == '__main__':
@@ -1,37 +1,47 @@
-USE metallum;
+CREATE UNIQUE INDEX dk_albums
+ON stg_albums (metallum_album_id, metallum_band_id);
 
-ALTER TABLE metallum.stg_albums
-ADD UNIQUE INDEX dk_albums (metallum_album_id, metallum_band_id);
+CREATE UNIQUE INDEX ix_albums_album_id
+ON stg_albums (stg_album_id);
 
-ALTER TABLE metallum.stg_albums
-ADD UNIQUE INDEX ix_albums_album_id (stg_album_id);
+CREATE UNIQUE INDEX dk_band_genres
+ON stg_band_genres (stg_band_id, genre_name (40), phase_name (5));
 
-ALTER TABLE metallum.stg_band_genres
-ADD UNIQUE INDEX dk_band_genres (stg_band_id, genre_name (40), phase_name (5));
+CREATE UNIQUE INDEX ix_band_genres_band_genre_id
+ON stg_band_genres (stg_band_genre_id);
 
-ALTER TABLE metallum.stg_band_genres
-ADD UNIQUE INDEX ix_band_genres_band_genre_id (stg_band_genre_id);
+CREATE UNIQUE INDEX dk_bands
+ON stg_bands (metallum_band_id);
 
-ALTER TABLE metallum.stg_bands
-ADD UNIQUE INDEX dk_bands (metallum_band_id);
+CREATE UNIQUE INDEX ix_bands_band_id
+ON stg_bands (stg_band_id);
 
-ALTER TABLE metallum.stg_bands
-ADD UNIQUE INDEX ix_bands_band_id (stg_band_id);
+CREATE UNIQUE INDEX dk_countries
+ON stg_countries (country_name (50));
 
-ALTER TABLE metallum.stg_countries
-ADD UNIQUE INDEX dk_countries (country_name (50));
+CREATE UNIQUE INDEX ix_countries_country_id
+ON stg_countries (stg_country_id);
 
-ALTER TABLE metallum.stg_countries
-ADD UNIQUE INDEX ix_countries_country_id (stg_country_id);
+CREATE UNIQUE INDEX ix_tracks_track_id
+ON stg_tracks (stg_track_id);
 
-ALTER TABLE metallum.stg_tracks
-ADD UNIQUE INDEX ix_tracks_track_id (stg_track_id);
+CREATE INDEX nix_tracks_band_album
+ON stg_tracks (metallum_band_id, metallum_album_id);
 
-ALTER TABLE metallum.stg_tracks
-ADD INDEX nix_tracks_band_album (metallum_band_id, metallum_album_id);
+CREATE UNIQUE INDEX dk_genres
+ON stg_genres (genre_name (50));
 
-ALTER TABLE metallum.stg_genres
-ADD UNIQUE INDEX dk_genres (genre_name (50));
+CREATE UNIQUE INDEX ix_genres_genre_id
+ON stg_genres (stg_genre_id);
 
-ALTER TABLE metallum.stg_genres
-ADD UNIQUE INDEX ix_genres_genre_id (stg_genre_id);
\ No newline at end of file
+CREATE UNIQUE INDEX ix_genre_combos_combination_id
+ON stg_genre_combos (stg_genre_combination_id);
+
+CREATE UNIQUE INDEX ix_genre_permutations_permutation_id
+ON stg_genre_permutations (stg_genre_permutation_id);
+
+CREATE UNIQUE INDEX dk_band_genre_phases
+ON stg_band_genre_phases (stg_band_id, genre_name (40));
+
+CREATE UNIQUE INDEX ix_band_genre_phases_band_genre_phase_id
+ON stg_band_genre_phases (stg_band_genre_phase_id);
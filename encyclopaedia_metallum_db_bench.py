@@ -0,0 +1,262 @@
+"""Microbenchmarks for the transforms in encyclopaedia_metallum_db, run on
+synthetic data so that no database is needed, e.g.
+
+    python encyclopaedia_metallum_db_bench.py --sizes 10000 100000 \\
+        --baseline db_bench.json
+
+The default sizes include 1M rows, which takes a few minutes.
+
+Timings are compared against the baseline, and the script exits with a
+non-zero status if any benchmark is more than --tolerance slower than it
+was. --save writes the timings as the new baseline"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import encyclopaedia_metallum_db as db
+
+
+SIZES = (10000, 100000, 1000000)
+REPEAT = 3
+TOLERANCE = 0.2
+
+# raw genres are shared by about this many bands each
+BANDS_PER_GENRE = 7
+
+GENRE_WORDS = ('Black', 'Death', 'Thrash', 'Heavy', 'Doom', 'Power',
+               'Progressive', 'Speed', 'Folk', 'Viking', 'Gothic',
+               'Industrial', 'Sludge', 'Stoner', 'Symphonic', 'Melodic',
+               'Atmospheric', 'Funeral', 'Technical', 'Brutal', 'Epic',
+               'Post', 'Nu', 'Hard', 'Jazzy', 'Avant-garde', 'Raw')
+GENRE_STYLES = ('Metal', 'Metal', 'Metal', 'Rock', 'Grindcore', 'Deathcore',
+                'Metalcore', 'Hardcore', 'Punk', "Rock 'n' Roll",
+                "Death 'n' Roll", 'Ambient', 'Noise', 'Drone',
+                'Pop Rock', 'Trip Hop', 'Drum and Bass',
+                'Neue Deutsche Härte')
+GENRE_PHASES = ('early', 'mid', 'later', 'early/mid', 'mid, later',
+                '1990-1995', 'debut')
+
+
+def _random_genre(rng):
+    genres = []
+    for _ in range(rng.choice((1, 1, 2, 2, 3))):
+        genre = f'{rng.choice(GENRE_WORDS)} {rng.choice(GENRE_STYLES)}'
+
+        roll = rng.random()
+        if roll < 0.25:
+            genre += f' ({rng.choice(GENRE_PHASES)})'
+        elif roll < 0.35:
+            genre += f'/{rng.choice(GENRE_WORDS)} {rng.choice(GENRE_STYLES)}'
+        elif roll < 0.4:
+            genre += f' with {rng.choice(GENRE_WORDS)} influences'
+
+        genres.append(genre)
+
+    return ', '.join(genres)
+
+
+def _bands(size, seed=0):
+    rng = random.Random(seed)
+    raw_genres = [_random_genre(rng)
+                  for _ in range(max(100, size // BANDS_PER_GENRE))]
+    return pd.DataFrame({'stg_band_id': range(size),
+                         'genre': [rng.choice(raw_genres)
+                                   for _ in range(size)]})
+
+
+def _quietly(func, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+
+def _band_genres(size):
+    band_genres_df = _quietly(db._band_genres, _bands(size), {})
+    return band_genres_df.reset_index()
+
+
+def _write_tracks(size, directory):
+    rng = random.Random(0)
+    album_ids = [rng.randrange(1, 10 ** 6) for _ in range(size // 10 + 1)]
+
+    tracks_df = pd.DataFrame({
+        'metallum_band_id': [album_id // 3 for album_id in album_ids
+                             for _ in range(10)][:size],
+        'band_name': 'Band',
+        'metallum_album_id': [album_id for album_id in album_ids
+                              for _ in range(10)][:size],
+        'album_name': 'Album',
+        'album_url': 'https://www.metal-archives.com/albums/Band/Album/1',
+        'track_name': [f'Track {number % 10 + 1}' for number in range(size)],
+        'track_number': [number % 10 + 1 for number in range(size)],
+        'track_length': '04:20'
+    })
+    tracks_df.to_csv(os.path.join(directory, 'tracks.csv'), index=False)
+
+
+def _setup_clean_genre(size):
+    genres = _bands(size)['genre'].str.lower()
+    return (genres.tolist(),)
+
+
+def _run_clean_genre(genres):
+    for genre in genres:
+        db.clean_genre(genre)
+
+
+def _setup_clean_genres(size):
+    return (_bands(size)['genre'].str.lower(),)
+
+
+def _setup_band_genres(size):
+    return (_bands(size),)
+
+
+def _run_band_genres(bands_df):
+    _quietly(db._band_genres, bands_df, {})
+
+
+def _setup_band_genres_cached(size):
+    bands_df = _bands(size)
+    genre_cache = {}
+    _quietly(db._band_genres, bands_df, genre_cache)
+    return bands_df, genre_cache
+
+
+def _run_band_genres_cached(bands_df, genre_cache):
+    _quietly(db._band_genres, bands_df, genre_cache)
+
+
+def _setup_band_genre_phases(size):
+    return (_band_genres(size),)
+
+
+def _setup_genre_relationships(size):
+    band_genres_df = _band_genres(size)
+    band_genres_df['stg_genre_id'], _ = \
+        pd.factorize(band_genres_df['genre_name'])
+    return (band_genres_df,)
+
+
+def _setup_read_track_pages(size):
+    _write_tracks(size, os.getcwd())
+    return ()
+
+
+def _run_read_track_pages():
+    for _ in db._read_track_pages(output_format='csv'):
+        pass
+
+
+BENCHMARKS = {
+    'clean_genre': (_setup_clean_genre, _run_clean_genre),
+    'clean_genres': (_setup_clean_genres, db.clean_genres),
+    'process_band_genres': (_setup_band_genres, _run_band_genres),
+    'process_band_genres_cached': (_setup_band_genres_cached,
+                                   _run_band_genres_cached),
+    'process_band_genre_changes': (_setup_band_genre_phases,
+                                   db._band_genre_phases),
+    'process_genre_relationships': (_setup_genre_relationships,
+                                    db._genre_relationships),
+    'load_tracks': (_setup_read_track_pages, _run_read_track_pages),
+}
+
+
+def run_benchmarks(names=tuple(BENCHMARKS), sizes=SIZES, repeat=REPEAT):
+    """Returns the best of `repeat` timings of each benchmark at each size,
+    keyed by 'name[size]'. Setting up the data isn't timed"""
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        working_directory = os.getcwd()
+        os.chdir(directory)
+
+        try:
+            for name in names:
+                setup_func, run_func = BENCHMARKS[name]
+
+                for size in sizes:
+                    args = setup_func(size)
+
+                    best = float('inf')
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        run_func(*args)
+                        best = min(best, time.perf_counter() - start)
+
+                    key = f'{name}[{size}]'
+                    timings[key] = best
+                    print(f'{key:<42} {best:>10.4f}s')
+        finally:
+            os.chdir(working_directory)
+
+    return timings
+
+
+def compare_to_baseline(timings, baseline, tolerance=TOLERANCE):
+    """Returns the benchmarks that are more than `tolerance` slower than
+    their baseline"""
+    regressions = []
+    for key, seconds in timings.items():
+        baseline_seconds = baseline.get(key)
+        if baseline_seconds is None:
+            continue
+
+        change = seconds / baseline_seconds - 1
+        if change > tolerance:
+            regressions.append(key)
+            print(f'regression | {key} | {baseline_seconds:.4f}s -> '
+                  f'{seconds:.4f}s ({change:+.0%})')
+
+    return regressions
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--baseline', help='a JSON file of earlier timings')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slowdown, as a fraction')
+    parser.add_argument('--save', action='store_true',
+                        help='write the timings to the baseline file')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = _parse_args()
+    benchmark_timings = run_benchmarks(args.benchmarks, args.sizes,
+                                       args.repeat)
+
+    if args.baseline is None:
+        sys.exit(0)
+
+    if args.save:
+        baseline_timings = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as baseline_file:
+                baseline_timings = json.load(baseline_file)
+
+        baseline_timings.update(benchmark_timings)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline_timings, baseline_file, indent=2,
+                      sort_keys=True)
+        sys.exit(0)
+
+    with open(args.baseline, 'r') as baseline_file:
+        baseline_timings = json.load(baseline_file)
+
+    if compare_to_baseline(benchmark_timings, baseline_timings,
+                           args.tolerance):
+        sys.exit(1)
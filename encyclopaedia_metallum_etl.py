@@ -2,10 +2,18 @@
 
 import time
 import json
+import atexit
+import csv
 import re
+import struct
 import sys
-import copy
 import os
+import asyncio
+import email.utils
+import gzip
+import hashlib
+import functools
+import contextlib
 
 import requests
 import pandas as pd
@@ -14,6 +22,25 @@ import datetime as dt
 
 import queue as q
 import threading as thr
+import concurrent.futures as cf
+
+import encyclopaedia_metallum_metrics as metrics
+
+try:
+    import aiohttp
+except ImportError:  # only required by the async engine
+    aiohttp = None
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:  # only required by the lxml parser backend
+    lxml = None
+
+try:
+    import pyarrow
+except ImportError:  # only required by the parquet output format
+    pyarrow = None
 
 
 ALPHABET = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
@@ -21,54 +48,231 @@ ALPHABET = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M',
             'NBR', '~']  # the alphabet, according to metal archives
 
 METAL_ARCHIVES_ROOT = 'www.metal-archives.com'
+METAL_ARCHIVES_URL = f'https://{METAL_ARCHIVES_ROOT}'
 USER_AGENT_STR = ('Python-3.9')
 
 BATCH_SIZE = 500
-MAX_ATTEMPTS = 3
+MAX_ATTEMPTS = 5
 
 NUMBER_OF_THREADS = 32
+POOL_SIZE = NUMBER_OF_THREADS
+
+ENGINES = ('threads', 'async')
+PARSER_BACKENDS = ('bs4', 'lxml')
+OUTPUT_FORMATS = ('csv', 'parquet')
+ASYNC_CONCURRENCY = 1000
+
+# processes that parse downloaded pages. with 0, pages are parsed on the
+# thread (or event loop) that downloaded them
+PARSE_WORKERS = 0
+PARSE_QUEUE_SIZE = NUMBER_OF_THREADS * 4
+
+# requests per second shared by every worker. like tcp's congestion window,
+# the limit grows by RATE_INCREASE requests in flight for each round trip of
+# successful requests, and is multiplied by RATE_DECREASE, at most once per
+# round trip, when the server answers with a 429 or with RATE_ERROR_BURST
+# 5xx errors in a row. isolated errors, such as cloudflare's random 520s,
+# are retried without slowing down. the limit only grows while workers are
+# actually held back by it, and has no ceiling unless MAX_RATE_LIMIT is set
+RATE_LIMIT = 8.0
+MIN_RATE_LIMIT = 0.25
+MAX_RATE_LIMIT = None
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+RATE_ERROR_BURST = 3
+
+# downloaded pages are kept here so that parsers can be re-run without
+# hitting the site. online, a cached page is revalidated with a conditional
+# request unless it is younger than CACHE_TTL seconds, which a replay of a
+# recent crawl can raise. the band lists are always downloaded again
+CACHE_DIR = 'cache'
+CACHE_TTL = 0
+LIVE_ENDPOINTS = ('browse/ajax-letter/',)
+CACHE_MAX_BYTES = 50 * 1024 ** 3
 
 METALLUM_LOG = 'metallum.log'
 
+# the log is rotated once it reaches LOG_MAX_BYTES, keeping LOG_BACKUPS
+# older logs. the log writer takes up to LOG_BATCH_LINES lines per flush
+LOG_MAX_BYTES = 100 * 1024 ** 2
+LOG_BACKUPS = 5
+LOG_BATCH_LINES = 1000
+LOG_FLUSH_POLL = 0.1
+
+# metrics are snapshotted to METRICS_PATH.json and METRICS_PATH.prom
+METRICS_PATH = 'out/metrics'
+TOMBSTONES_CSV = 'out/tombstones.csv'
+
+# number of finished albums written to tracks.csv per checkpoint
+CHECKPOINT_SIZE = 500
+
+# results each crawler worker gathers before handing them to the writer
+# thread, and the number of handed over batches that may wait for it
+RESULT_BATCH_SIZE = 20
+RESULT_QUEUE_SIZE = NUMBER_OF_THREADS * 2
+
+# rows per row group in parquet outputs
+PARQUET_ROW_GROUP_SIZE = 100000
+
+TRACK_COLUMNS = ('metallum_band_id', 'band_name', 'metallum_album_id',
+                 'album_name', 'album_url', 'track_name', 'track_number',
+                 'track_length')
+FAILED_ALBUM_COLUMNS = ('metallum_band_id', 'band_name', 'album_id',
+                        'album_name', 'album_url')
+FAILED_BAND_COLUMNS = ('metallum_band_id', 'band_name', 'discography_url')
+
+# column types of the parquet outputs. every track column is typed so that
+# each checkpointed batch of tracks is written with the same schema
+OUTPUT_DTYPES = {
+    'bands': {'metallum_band_id': 'int64', 'country': 'category',
+              'status': 'category'},
+    'albums': {'metallum_band_id': 'int64', 'metallum_album_id': 'int64',
+               'album_type': 'category'},
+    'tracks': {'metallum_band_id': 'int64', 'band_name': 'string',
+               'metallum_album_id': 'int64', 'album_name': 'string',
+               'album_url': 'string', 'track_name': 'string',
+               'track_number': 'string', 'track_length': 'string'},
+}
+
+# the HTML headers that metal archives demands
+HEADERS = {
+    'Accept': ('text/html,' +
+               'application/xhtml+xml,' +
+               'application/xml;q=0.9,' +
+               'image/webp,*/*;q=0.8'),
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Connection': 'keep-alive',
+    'Host': METAL_ARCHIVES_ROOT,
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': USER_AGENT_STR
+}
+
 
 class LogComponent:
-    '''A thread-safe class for logging info to stdout or a specified file'''
+    '''A thread-safe class for logging info to stdout or a specified file.
+    Messages are queued and written by a background thread, which keeps the
+    log file open, flushes once per batch of lines and rotates the log once
+    it grows past max_bytes'''
 
-    def __init__(self, stdout=True, path=None):
+    def __init__(self, stdout=True, path=None, max_bytes=LOG_MAX_BYTES,
+                 backups=LOG_BACKUPS):
         if not stdout and path is None:
             print('[-]: a path is required when stdout is False')
             stdout = True
 
-        if stdout and path is None:
-            # only write to stdout
-            def _print_wrapper(*values, **kwargs):
-                print(*values, **kwargs)
-
-        elif stdout and path is not None:
-            # write to log and stdout
-            def _print_wrapper(*values, **kwargs):
-                with open(path, 'a') as log_file:
-                    print(*values, **kwargs, file=log_file)
-                print(*values, **kwargs)
+        self.stdout = stdout
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
 
+        self._is_enabled = True
+        self._messages = q.Queue()
+        self._log_file = None
+        self._writer = None
+        self._start_lock = thr.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._writer is not None:
+                return
+
+            self._writer = thr.Thread(target=self._write_messages)
+            self._writer.daemon = True
+            self._writer.start()
+
+            # write out whatever is still queued when the program exits
+            atexit.register(self.flush)
+
+    def _write_messages(self):
+        while True:
+            lines = list(self._messages.get())
+            message_count = 1
+
+            while len(lines) < LOG_BATCH_LINES:
+                try:
+                    lines.extend(self._messages.get_nowait())
+                except q.Empty:
+                    break
+                message_count += 1
+
+            # a failed write mustn't stop the writer, or the messages still
+            # queued are never marked as done
+            try:
+                self._write_lines(lines)
+            except Exception as exc:
+                self._report_error(exc)
+            finally:
+                for _ in range(message_count):
+                    self._messages.task_done()
+
+    @staticmethod
+    def _report_error(exc):
+        try:
+            print(f'[-]: could not write log messages: {exc!a}',
+                  file=sys.stderr)
+        except Exception:
+            pass
+
+    def _write_lines(self, lines):
+        text = '\n'.join(lines) + '\n'
+
+        if self.path is not None:
+            if self._log_file is None:
+                self._log_file = open(self.path, 'a', encoding='utf-8')
+
+            self._log_file.write(text)
+            self._log_file.flush()
+
+            if self._log_file.tell() >= self.max_bytes:
+                self._rotate()
+
+        if self.stdout:
+            try:
+                sys.stdout.write(text)
+            except UnicodeEncodeError:
+                # e.g. cyrillic band names on a stdout that isn't utf-8
+                encoding = sys.stdout.encoding or 'ascii'
+                sys.stdout.write(text.encode(encoding, 'backslashreplace')
+                                 .decode(encoding))
+            sys.stdout.flush()
+
+    def _rotate(self):
+        """Moves metallum.log to metallum.log.1, metallum.log.1 to
+        metallum.log.2 and so on, dropping the oldest"""
+        self._log_file.close()
+        self._log_file = None
+
+        for number in range(self.backups - 1, 0, -1):
+            backup_path = f'{self.path}.{number}'
+            if os.path.exists(backup_path):
+                os.replace(backup_path, f'{self.path}.{number + 1}')
+
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
         else:
-            # only write to log
-            def _print_wrapper(*values, **kwargs):
-                with open(path, 'a') as log_file:
-                    print(*values, **kwargs, file=log_file)
+            os.remove(self.path)
+
+    def message(self, text):
+        if not self._is_enabled:
+            return
 
-        self._write_func = _print_wrapper
+        if self._writer is None:
+            self._start()
 
-        self._is_enabled = True
-        self._print_lock = thr.Lock()
+        timestamp = dt.datetime.now()
+        self._messages.put([f'[{timestamp}]: {line}'
+                            for line in text.split('\n')])
 
-    def message(self, text):
-        lines = text.split('\n')
+    def flush(self):
+        """Waits until every queued message has been written, or until the
+        writer thread is gone"""
+        if self._writer is None:
+            return
 
-        if self._is_enabled:
-            with self._print_lock:
-                for text in lines:
-                    self._write_func(f'[{dt.datetime.now()}]: {text}')
+        with self._messages.all_tasks_done:
+            while self._messages.unfinished_tasks and self._writer.is_alive():
+                self._messages.all_tasks_done.wait(LOG_FLUSH_POLL)
 
     def disable(self):
         self._is_enabled = False
@@ -76,6 +280,834 @@ class LogComponent:
 
 class Output:
     log = LogComponent(path=METALLUM_LOG)
+    format = 'csv'
+
+
+class SessionPool:
+    '''Hands out one keep-alive session per thread. Every session shares
+    the same connection pool, so connections are reused across threads'''
+
+    def __init__(self, pool_size=POOL_SIZE, headers=None):
+        self.pool_size = pool_size
+        self.headers = dict(HEADERS if headers is None else headers)
+
+        # urllib3's pools are thread-safe, requests' sessions are not
+        self._adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                      pool_maxsize=pool_size,
+                                                      pool_block=True)
+        self._local = thr.local()
+
+    def get(self):
+        session = getattr(self._local, 'session', None)
+
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            self._local.session = session
+
+        return session
+
+    def close(self):
+        self._adapter.close()
+
+
+class RateLimiter:
+    '''A thread-safe token bucket shared by every worker. The rate grows
+    additively while requests succeed and is cut multiplicatively when the
+    server pushes back, pausing all workers at once. A request that is
+    retried waits for as long as the server's Retry-After asks'''
+
+    def __init__(self, rate=RATE_LIMIT, min_rate=MIN_RATE_LIMIT,
+                 max_rate=MAX_RATE_LIMIT, increase=RATE_INCREASE,
+                 decrease=RATE_DECREASE, error_burst=RATE_ERROR_BURST):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.error_burst = error_burst
+        self.round_trip = None
+
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._limited_at = 0.0
+        self._errors = 0
+        self._lock = thr.Lock()
+
+    def _reserve(self):
+        """Takes a token and returns how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            burst = max(1.0, self.rate)
+            refill = (now - self._updated) * self.rate
+            self._tokens = min(burst, self._tokens + refill) - 1
+            self._updated = now
+
+            wait = max(0.0, -self._tokens / self.rate)
+            if wait > 0:
+                self._limited_at = now
+            return max(wait, self._paused_until - now)
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _observe(self, round_trip):
+        # a moving average of how long requests take
+        if round_trip is not None:
+            if self.round_trip is None:
+                self.round_trip = round_trip
+            else:
+                self.round_trip = 0.8 * self.round_trip + 0.2 * round_trip
+
+    def _decrease(self, now):
+        # every in-flight request sees the same overload, so only cut the
+        # rate once per round trip
+        interval = max(1 / self.rate, self.round_trip or 0.0)
+        if now - self._decreased_at > interval:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._decreased_at = now
+            self._paused_until = max(self._paused_until, now + 1 / self.rate)
+
+    def success(self, round_trip=None):
+        with self._lock:
+            self._observe(round_trip)
+            self._errors = 0
+
+            # a rate the workers can't use up isn't being tested, so it
+            # only grows if one of them had to wait in the last second
+            if time.monotonic() - self._limited_at > 1.0:
+                return
+
+            # +increase requests in flight per round trip, which is
+            # +increase / round_trip requests/second each round trip
+            round_trip = self.round_trip or 1.0
+            step = self.increase / (self.rate * round_trip * round_trip)
+            self.rate += min(self.increase, step)
+            if self.max_rate is not None:
+                self.rate = min(self.max_rate, self.rate)
+
+    def backoff(self, retry_after=None, round_trip=None):
+        """The server is throttling requests. Returns the seconds to wait
+        before retrying the request"""
+        with self._lock:
+            self._observe(round_trip)
+            self._decrease(time.monotonic())
+            return 0.0 if retry_after is None else retry_after
+
+    def error(self, retry_after=None, round_trip=None):
+        """A request failed with a 5xx or a connection error. Only a burst
+        of them in a row is taken as the server being overloaded. Returns
+        the seconds to wait before retrying the request"""
+        with self._lock:
+            self._observe(round_trip)
+            self._errors += 1
+
+            if self._errors >= self.error_burst:
+                self._decrease(time.monotonic())
+
+            return 0.0 if retry_after is None else retry_after
+
+
+class ResponseCache:
+    '''Stores gzipped pages on disk, addressed by a hash of their URL.
+    Reads touch a page's mtime, which lets evict() drop the least recently
+    used pages first'''
+
+    def __init__(self, path=CACHE_DIR, ttl=CACHE_TTL,
+                 max_bytes=CACHE_MAX_BYTES, offline=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        directory = os.path.join(self.path, key[:2])
+        return (os.path.join(directory, f'{key}.gz'),
+                os.path.join(directory, f'{key}.json'))
+
+    def get(self, url):
+        """Returns the cached text and metadata for a URL, or None"""
+        page_path, metadata_path = self._paths(url)
+
+        try:
+            with open(metadata_path, 'r') as metadata_file:
+                metadata = json.load(metadata_file)
+            with gzip.open(page_path, 'rt', encoding='utf-8') as page_file:
+                page_text = page_file.read()
+            os.utime(page_path)
+        except (OSError, ValueError):
+            return None
+
+        return page_text, metadata
+
+    def is_fresh(self, url, metadata):
+        """Whether a page can be used online without revalidating it"""
+        if any(endpoint in url for endpoint in LIVE_ENDPOINTS):
+            return False
+        return time.time() - metadata['stored_at'] < self.ttl
+
+    @staticmethod
+    def validators(metadata):
+        """Returns the headers for revalidating a stale page"""
+        headers = {}
+        if metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    def put(self, url, page_text, headers):
+        metadata = {'url': url,
+                    'etag': headers.get('ETag'),
+                    'last_modified': headers.get('Last-Modified'),
+                    'stored_at': time.time()}
+
+        page_path, metadata_path = self._paths(url)
+        os.makedirs(os.path.dirname(page_path), exist_ok=True)
+
+        # write to a temporary file first, so that concurrent readers
+        # never see a partially written page
+        suffix = f'.{os.getpid()}.{thr.get_ident()}.tmp'
+        with gzip.open(page_path + suffix, 'wt', encoding='utf-8') as file:
+            file.write(page_text)
+        os.replace(page_path + suffix, page_path)
+
+        self._write_metadata(metadata_path + suffix, metadata)
+        os.replace(metadata_path + suffix, metadata_path)
+
+    def refresh(self, url, metadata):
+        """Marks a page as fresh after the server reports it unchanged"""
+        _, metadata_path = self._paths(url)
+        metadata = dict(metadata, stored_at=time.time())
+
+        suffix = f'.{os.getpid()}.{thr.get_ident()}.tmp'
+        self._write_metadata(metadata_path + suffix, metadata)
+        os.replace(metadata_path + suffix, metadata_path)
+
+    @staticmethod
+    def _write_metadata(path, metadata):
+        with open(path, 'w') as metadata_file:
+            json.dump(metadata, metadata_file)
+
+    def evict(self):
+        """Deletes the least recently used pages until the cache fits in
+        max_bytes"""
+        pages = []
+        total_bytes = 0
+        for directory, _, files in os.walk(self.path):
+            for name in files:
+                if not name.endswith('.gz'):
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                pages.append((stat.st_mtime, stat.st_size, directory, name))
+                total_bytes += stat.st_size
+
+        pages.sort()
+        for _, size, directory, name in pages:
+            if total_bytes <= self.max_bytes:
+                break
+
+            key = name[:-len('.gz')]
+            for path in (f'{key}.gz', f'{key}.json'):
+                try:
+                    os.remove(os.path.join(directory, path))
+                except FileNotFoundError:
+                    pass
+            total_bytes -= size
+
+
+class ResultCollector:
+    '''Gathers the results of crawler workers without a shared list. Each
+    worker thread fills a batch of its own and hands full batches to a
+    single writer thread, which passes them to write(results) once at least
+    write_size results have arrived. write is only ever called from the
+    writer thread'''
+
+    _FLUSH = object()
+
+    def __init__(self, write, write_size=1, batch_size=RESULT_BATCH_SIZE,
+                 stage='results'):
+        self._write = write
+        self._stage = stage
+        self._write_size = write_size
+        self._batch_size = batch_size
+
+        self._local = thr.local()
+        self._buffers = []
+        self._buffers_lock = thr.Lock()
+        self._errors = []
+
+        self._batches = q.Queue(RESULT_QUEUE_SIZE)
+        self._writer = thr.Thread(target=self._write_batches)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _buffer(self):
+        try:
+            return self._local.buffer
+        except AttributeError:
+            buffer = self._local.buffer = []
+            with self._buffers_lock:
+                self._buffers.append(buffer)
+            return buffer
+
+    def _hand_over(self, buffer):
+        batch = buffer[:]
+        buffer.clear()
+        self._batches.put(batch)
+
+    def add(self, result):
+        if self._errors:
+            raise self._errors[0]
+
+        buffer = self._buffer()
+        buffer.append(result)
+
+        if len(buffer) >= self._batch_size:
+            self._hand_over(buffer)
+
+    def _write_batches(self):
+        pending = []
+
+        while True:
+            batch = self._batches.get()
+
+            try:
+                if batch is None:
+                    break
+
+                flushing = batch is self._FLUSH
+                if not flushing:
+                    pending.extend(batch)
+
+                if pending and (flushing or
+                                len(pending) >= self._write_size):
+                    results, pending = pending, []
+
+                    # advanced first, so that write() reports the progress
+                    # including these results
+                    metrics.registry.advance(self._stage, len(results))
+                    with metrics.registry.timer('write_seconds',
+                                                stage=self._stage):
+                        self._write(results)
+
+                    metrics.registry.count('results_written_total',
+                                           len(results), stage=self._stage)
+
+                metrics.registry.gauge('result_queue_depth',
+                                       self._batches.qsize(),
+                                       stage=self._stage)
+            except Exception as exc:
+                self._errors.append(exc)
+            finally:
+                self._batches.task_done()
+
+    def flush(self):
+        """Hands over every worker's partial batch and waits until all of
+        them are written. Call it once the workers are idle"""
+        with self._buffers_lock:
+            buffers = list(self._buffers)
+
+        for buffer in buffers:
+            if buffer:
+                self._hand_over(buffer)
+
+        self._batches.put(self._FLUSH)
+        self._batches.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._batches.put(None)
+            self._writer.join()
+
+
+class Network:
+    sessions = SessionPool()
+    limiter = RateLimiter()
+    cache = ResponseCache()
+    threads = NUMBER_OF_THREADS
+    concurrency = ASYNC_CONCURRENCY
+
+
+class Parsing:
+    backend = 'bs4'
+
+
+class FetchException(Exception):
+    """Page could not be downloaded"""
+
+
+class AlbumParseException(Exception):
+    """Album data could not be parsed"""
+
+
+# a work item that fails with one of these is skipped, not fatal
+CRAWL_FAILURES = (FetchException, AlbumParseException)
+
+
+def _is_retryable(status):
+    return status == 429 or status >= 500
+
+
+def _retry_after(headers):
+    """Returns the seconds requested by a Retry-After header, if any"""
+    value = headers.get('Retry-After')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    now = dt.datetime.now(dt.timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
+
+
+def _push_back(status, headers, round_trip):
+    """Tells the rate limiter about a retryable answer, returning the
+    seconds to wait before retrying"""
+    retry_after = _retry_after(headers)
+    if status == 429:
+        return Network.limiter.backoff(retry_after, round_trip)
+    return Network.limiter.error(retry_after, round_trip)
+
+
+def _check_cache(url):
+    """Returns the cached text for a URL if it can be used without a
+    request, along with a stale cache entry that needs revalidating"""
+    cache = Network.cache
+    if cache is None:
+        return None, None
+
+    entry = cache.get(url)
+    if entry is None:
+        metrics.registry.count('cache_lookups_total', result='miss')
+        if cache.offline:
+            raise FetchException(f'{url}: not cached')
+        return None, None
+
+    page_text, metadata = entry
+    if cache.offline or cache.is_fresh(url, metadata):
+        metrics.registry.count('cache_lookups_total', result='hit')
+        return page_text, None
+
+    metrics.registry.count('cache_lookups_total', result='stale')
+    return None, entry
+
+
+def _revalidation_headers(stale_entry):
+    if stale_entry is None:
+        return None
+
+    _, metadata = stale_entry
+    return ResponseCache.validators(metadata)
+
+
+def _store_page(url, page_text, headers):
+    if Network.cache is not None:
+        Network.cache.put(url, page_text, headers)
+
+
+def _refresh_page(url, stale_entry):
+    page_text, metadata = stale_entry
+    Network.cache.refresh(url, metadata)
+    return page_text
+
+
+def _record_response(status, seconds, page_bytes=0):
+    metrics.registry.observe('fetch_seconds', seconds)
+    metrics.registry.count('fetch_responses_total', status=status)
+    if page_bytes:
+        metrics.registry.count('fetch_bytes_total', page_bytes)
+
+
+def _acquire_rate_limit():
+    with metrics.registry.timer('rate_limit_wait_seconds'):
+        Network.limiter.acquire()
+    metrics.registry.gauge('rate_limit', Network.limiter.rate)
+
+
+async def _acquire_rate_limit_async():
+    with metrics.registry.timer('rate_limit_wait_seconds'):
+        await Network.limiter.acquire_async()
+    metrics.registry.gauge('rate_limit', Network.limiter.rate)
+
+
+def _fetch(url):
+    """Requests a page using the calling thread's session, retrying
+    through the shared rate limiter when the server pushes back"""
+    page_text, stale_entry = _check_cache(url)
+    if page_text is not None:
+        return page_text
+
+    headers = _revalidation_headers(stale_entry)
+
+    for _ in range(MAX_ATTEMPTS):
+        _acquire_rate_limit()
+
+        start = time.perf_counter()
+        try:
+            response = Network.sessions.get().get(url, headers=headers)
+        except requests.RequestException as exc:
+            round_trip = time.perf_counter() - start
+            _record_response('error', round_trip)
+            time.sleep(Network.limiter.error(round_trip=round_trip))
+            error = repr(exc)
+            continue
+
+        round_trip = time.perf_counter() - start
+        _record_response(response.status_code, round_trip,
+                         len(response.content))
+
+        if response.status_code == 304 and stale_entry is not None:
+            Network.limiter.success(round_trip)
+            return _refresh_page(url, stale_entry)
+
+        if response.status_code == 200:
+            Network.limiter.success(round_trip)
+            _store_page(url, response.text, response.headers)
+            return response.text
+
+        error = f'{response.status_code} error'
+        if not _is_retryable(response.status_code):
+            break
+
+        time.sleep(_push_back(response.status_code, response.headers,
+                              round_trip))
+
+    raise FetchException(f'{url}: {error}')
+
+
+def _decode_page(page_bytes, encoding):
+    # like requests' response.text, bytes that aren't valid in the page's
+    # charset are replaced rather than failing the page
+    try:
+        return page_bytes.decode(encoding, errors='replace')
+    except LookupError:
+        return page_bytes.decode('utf-8', errors='replace')
+
+
+async def _fetch_async(session, url):
+    """Requests a page on the event loop and returns its text"""
+    page_text, stale_entry = _check_cache(url)
+    if page_text is not None:
+        return page_text
+
+    headers = _revalidation_headers(stale_entry)
+
+    for _ in range(MAX_ATTEMPTS):
+        await _acquire_rate_limit_async()
+
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                page_bytes = await response.read()
+                round_trip = time.perf_counter() - start
+                _record_response(response.status, round_trip,
+                                 len(page_bytes))
+
+                if response.status == 304 and stale_entry is not None:
+                    Network.limiter.success(round_trip)
+                    return _refresh_page(url, stale_entry)
+
+                if response.status == 200:
+                    page_text = _decode_page(page_bytes,
+                                             response.get_encoding())
+                    Network.limiter.success(round_trip)
+                    _store_page(url, page_text, response.headers)
+                    return page_text
+
+                error = f'{response.status} error'
+                response_headers = response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            round_trip = time.perf_counter() - start
+            _record_response('error', round_trip)
+            await asyncio.sleep(Network.limiter.error(round_trip=round_trip))
+            error = repr(exc)
+            continue
+
+        if not _is_retryable(response.status):
+            break
+
+        await asyncio.sleep(_push_back(response.status, response_headers,
+                                       round_trip))
+
+    raise FetchException(f'{url}: {error}')
+
+
+def _run_threaded(work_items, process, threads=NUMBER_OF_THREADS):
+    """Calls process on each work item from a pool of daemon threads"""
+    errors = []
+
+    def _process_concurrently():
+        halting = False
+        while not halting:
+            item = queue.get()
+            metrics.registry.gauge('work_queue_depth', queue.qsize())
+
+            halting = item is None
+
+            if not halting:
+                try:
+                    process(item)
+                except Exception as exc:
+                    errors.append(exc)
+            else:
+                current_thread = thr.current_thread()
+                thread_msg = (f'closing {current_thread.name} '
+                              f'(ID: {current_thread.native_id})')
+                Output.log.message(thread_msg)
+
+            queue.task_done()
+
+    queue = q.Queue(threads * 2)
+    for _ in range(threads):
+        t = thr.Thread(target=_process_concurrently)
+        t.daemon = True
+        t.start()
+
+    try:
+        for item in work_items:
+            if errors:
+                break
+            queue.put(item)
+
+        queue.join()
+    finally:
+        # push empty values into queue
+        # this will cause the thread loops to exit, closing each thread
+        for _ in range(threads):
+            queue.put(None)
+
+    if errors:
+        raise errors[0]
+
+
+def _run_async(work_items, process_async, concurrency=ASYNC_CONCURRENCY):
+    """Awaits process_async on each work item from a single event loop,
+    keeping at most `concurrency` items in flight"""
+    if aiohttp is None:
+        raise ImportError('the async engine requires aiohttp')
+
+    async def _process_asynchronously():
+        errors = []
+        tasks = set()
+        semaphore = asyncio.Semaphore(concurrency)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+
+        async def _process(session, item):
+            try:
+                await process_async(session, item)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                semaphore.release()
+
+        async with aiohttp.ClientSession(headers=HEADERS,
+                                         connector=connector) as session:
+            for item in work_items:
+                await semaphore.acquire()
+                if errors:
+                    semaphore.release()
+                    break
+
+                task = asyncio.create_task(_process(session, item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        if errors:
+            raise errors[0]
+
+    asyncio.run(_process_asynchronously())
+
+
+def _run(engine, work_items, process, process_async):
+    """Runs a crawl stage on the requested engine"""
+    if engine == 'threads':
+        _run_threaded(work_items, process, Network.threads)
+    elif engine == 'async':
+        _run_async(work_items, process_async, Network.concurrency)
+    else:
+        raise ValueError(f'engine must be one of {ENGINES}, not {engine!r}')
+
+
+def _timed_parse(parse, item, page_text, backend):
+    """Parses a page, returning the result and the seconds it took"""
+    start = time.perf_counter()
+    result = parse(item, page_text, backend)
+    return result, time.perf_counter() - start
+
+
+def _crawl(engine, work_items, get_url, parse, on_parsed, on_failed,
+           parse_workers=PARSE_WORKERS):
+    """Downloads the page for each work item, parses it with
+    parse(item, page_text, backend) and hands the result to on_parsed.
+    Items whose page can't be downloaded or parsed go to on_failed.
+
+    With parse_workers, parsing moves to a pool of processes so that it is
+    no longer serialized with the downloads by the GIL. On the async engine,
+    on_parsed and on_failed run on a thread of their own, as they may block
+    while the writer catches up"""
+    backend = Parsing.backend
+    executor = None
+    if parse_workers:
+        executor = cf.ProcessPoolExecutor(parse_workers)
+
+    handoff = None
+    if engine == 'async':
+        handoff = cf.ThreadPoolExecutor(1)
+
+    def _process(item):
+        try:
+            page_text = _fetch(get_url(item))
+            result, seconds = _timed_parse(parse, item, page_text, backend)
+        except CRAWL_FAILURES as exc:
+            on_failed(item, exc)
+        else:
+            metrics.registry.observe('parse_seconds', seconds,
+                                     parser=parse.__name__)
+            on_parsed(item, result)
+
+    async def _process_async(session, item):
+        loop = asyncio.get_running_loop()
+        try:
+            page_text = await _fetch_async(session, get_url(item))
+            if executor is None:
+                result, seconds = _timed_parse(parse, item, page_text,
+                                               backend)
+            else:
+                result, seconds = await loop.run_in_executor(
+                    executor, _timed_parse, parse, item, page_text, backend)
+        except CRAWL_FAILURES as exc:
+            await loop.run_in_executor(handoff, on_failed, item, exc)
+        else:
+            metrics.registry.observe('parse_seconds', seconds,
+                                     parser=parse.__name__)
+            await loop.run_in_executor(handoff, on_parsed, item, result)
+
+    try:
+        if engine == 'threads' and executor is not None:
+            _run_pipelined(work_items, get_url, parse, on_parsed, on_failed,
+                           executor, parse_workers)
+        else:
+            _run(engine, work_items, _process, _process_async)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if handoff is not None:
+            handoff.shutdown()
+
+
+def _run_pipelined(work_items, get_url, parse, on_parsed, on_failed,
+                   executor, parse_workers):
+    """Downloads pages on the I/O threads and parses them in executor.
+
+    Pages wait for a parser on a bounded queue and at most two pages per
+    parse worker are submitted at once, so the downloads block rather than
+    piling pages up in memory when parsing falls behind"""
+    backend = Parsing.backend
+    errors = []
+    raw_pages = q.Queue(PARSE_QUEUE_SIZE)
+    in_flight = thr.BoundedSemaphore(parse_workers * 2)
+
+    def _fetch_page(item):
+        # stops _run_threaded from handing out more work once parsing failed
+        if errors:
+            raise errors[0]
+
+        try:
+            page_text = _fetch(get_url(item))
+        except FetchException as exc:
+            on_failed(item, exc)
+        else:
+            raw_pages.put((item, page_text))
+
+    def _parsed(item, future):
+        try:
+            result, seconds = future.result()
+        except CRAWL_FAILURES as exc:
+            on_failed(item, exc)
+        except cf.CancelledError:
+            pass
+        except Exception as exc:
+            errors.append(exc)
+        else:
+            metrics.registry.observe('parse_seconds', seconds,
+                                     parser=parse.__name__)
+            try:
+                on_parsed(item, result)
+            except Exception as exc:
+                errors.append(exc)
+        finally:
+            in_flight.release()
+
+    def _dispatch_pages():
+        while True:
+            page = raw_pages.get()
+            if page is None:
+                break
+
+            metrics.registry.gauge('parse_queue_depth', raw_pages.qsize())
+
+            # after a failure, pages are still taken off the queue so that
+            # no download thread stays blocked on it
+            if errors:
+                continue
+
+            item, page_text = page
+            in_flight.acquire()
+            try:
+                future = executor.submit(_timed_parse, parse, item,
+                                         page_text, backend)
+            except Exception as exc:
+                # e.g. BrokenProcessPool when a parse worker was killed
+                errors.append(exc)
+                in_flight.release()
+            else:
+                future.add_done_callback(functools.partial(_parsed, item))
+
+    dispatcher = thr.Thread(target=_dispatch_pages)
+    dispatcher.daemon = True
+    dispatcher.start()
+
+    try:
+        _run_threaded(work_items, _fetch_page, Network.threads)
+    finally:
+        raw_pages.put(None)
+        dispatcher.join()
+
+    # wait for the last pages to be parsed
+    for _ in range(parse_workers * 2):
+        in_flight.acquire()
+
+    if errors:
+        raise errors[0]
 
 
 def _create_metallum_api_endpoint(letter, offset):
@@ -86,109 +1118,66 @@ def _create_metallum_api_endpoint(letter, offset):
     query_string = \
         f'sEcho=1&iDisplayStart={offset}&iDisplayLength={BATCH_SIZE}'
 
-    return f'https://{METAL_ARCHIVES_ROOT}/{endpoint}?{query_string}'
-
-
-def _get_metallum_records_by_letter(letter: str):
-    """Returns metal bands beginning with the given letter"""
-
-    # the HTML headers that metal archives demands
-    headers = {
-        'Accept': ('text/html,' +
-                   'application/xhtml+xml,' +
-                   'application/xml;q=0.9,' +
-                   'image/webp,*/*;q=0.8'),
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Connection': 'keep-alive',
-        'Host': METAL_ARCHIVES_ROOT,
-        'Upgrade-Insecure-Requests': '1',
-        'User-Agent': USER_AGENT_STR
-    }
-
-    offset = 0
-
-    # retrieve the first batch
-    endpoint = _create_metallum_api_endpoint(letter, offset)
-    band_data = requests.get(endpoint, headers=headers)
-    band_json = json.loads(band_data.text)
-
-    # determine total records to be determined
-    total_records = int(band_json['iTotalRecords'])
-    records = list(band_json['aaData'])
-
-    # load the remainder of data until the records loaded
-    # matches the total number of records specified in the
-    # first call
-    while offset < total_records:
-        # get the next batch
-        offset += BATCH_SIZE
-        attempts = 0
-        endpoint = _create_metallum_api_endpoint(letter, offset)
-
-        # what does metal archives' web server know?
-        # does it know things?
-        # lets find out
-        band_data = requests.get(endpoint, headers=headers)
-        if band_data.status_code == 200:
-            # it does know things
-            band_json = json.loads(band_data.text)
-        elif attempts < MAX_ATTEMPTS:
-            attempts += 1
-            offset -= BATCH_SIZE
-        else:
-            # it does NOT know things
-            raise Exception(f'{band_json.status_code} error')
+    return f'{METAL_ARCHIVES_URL}/{endpoint}?{query_string}'
+
 
-        records = records + band_json['aaData']
+def _parse_letter_page(page_text):
+    """Returns the total number of bands beginning with a letter, along with
+    the bands on the given page of the browse API"""
+    band_json = json.loads(page_text)
+    return int(band_json['iTotalRecords']), band_json['aaData']
 
-    return records
 
+def _letter_page_offsets(total_records):
+    """Returns the offsets of every page of a letter after the first"""
+    return range(BATCH_SIZE, total_records, BATCH_SIZE)
 
-def _write_band_data_to_csv(band_records: list):
-    # dump raw data to a CSV
+
+# the band link and status spans in each row of the browse API
+BAND_LINK_PATTERN = re.compile(r'^<a href=\'(?P<url>.+)\'>(?P<name>.+)<\/a>$')
+BAND_STATUS_PATTERN = re.compile(r'^<span class=".+">(?P<status>.+)<\/span>$')
+
+BAND_COLUMNS = ('metallum_band_id', 'name', 'genre', 'country', 'status',
+                'url')
+
+
+def _write_band_data_to_csv(band_records):
+    # dump raw data to a CSV, reading the records as they stream in
     bands_columns = ('band', 'country', 'genre', 'status')
     bands_df = pd.DataFrame(band_records, columns=bands_columns)
-    bands_df.to_csv('out/bands_raw.csv', index=False)
+    _write_output(bands_df, 'bands_raw')
 
-    # clean band data
-    bands = bands_df.to_records()
+    # clean band data a column at a time, reusing the raw frame
+    links_df = bands_df['band'].str.extract(BAND_LINK_PATTERN)
+    if links_df['url'].isna().any():
+        link = bands_df['band'][links_df['url'].isna()].iloc[0]
+        raise ValueError(f'unrecognized band link: {link!r}')
 
-    clean_records = []
+    bands_df['status'] = \
+        bands_df['status'].str.extract(BAND_STATUS_PATTERN, expand=False)
+    bands_df['url'] = links_df['url']
+    bands_df['name'] = links_df['name']
+    bands_df['metallum_band_id'] = \
+        links_df['url'].str.rsplit('/', n=1).str[-1]
+    del links_df
 
-    for _, link, country, genre, status in bands:
-        link_match = re.match(r'^<a href=\'(.+)\'>(.+)<\/a>$', link)
-        status_match = re.match(r'^<span class=".+">(.+)<\/span>$', status)
-        url = link_match.group(1)
-        name = link_match.group(2)
-        band_status = status_match.group(1)
+    _write_output(bands_df[list(BAND_COLUMNS)], 'bands')
 
-        band_id = url.split('/')[-1]
 
-        clean_records.append((band_id, name, genre, country, band_status, url))
+def _parse_discography_page(band_data, page_text, backend=None):
+    band_id, band_name, _ = band_data
+    return _parse_band_discography(band_id, band_name, page_text, backend)
 
-    band_columns = ('metallum_band_id', 'name', 'genre', 'country', 'status',
-                    'url')
-    clean_df = pd.DataFrame(clean_records, columns=band_columns)
-    clean_df.to_csv('out/bands.csv', index=False)
 
+def _parse_band_discography(band_id, band_name, page_text, backend=None):
+    """Returns the albums on a band's discography page"""
+    if (backend or Parsing.backend) == 'lxml':
+        return _parse_band_discography_lxml(band_id, band_name, page_text)
+    return _parse_band_discography_bs4(band_id, band_name, page_text)
 
-def _download_band_discography(band_id, band_name, discography_url):
-    band_webpage = None
-    max_attempts = 3
-    attempts = 0
-    while attempts < max_attempts:
-        try:
-            band_webpage = requests.get(discography_url)
-        except Exception:
-            if attempts < max_attempts:
-                time.sleep(120)
-                attempts += 1
-                continue
-            raise
-        break
 
-    band_soup = bs.BeautifulSoup(band_webpage.text, 'html.parser')
+def _parse_band_discography_bs4(band_id, band_name, page_text):
+    band_soup = bs.BeautifulSoup(page_text, 'html.parser')
     band_disco_soup = band_soup.find_all('tr')[1:]
 
     album_records = []
@@ -215,6 +1204,39 @@ def _download_band_discography(band_id, band_name, discography_url):
     return album_records
 
 
+def _parse_band_discography_lxml(band_id, band_name, page_text):
+    try:
+        band_tree = lxml.html.fromstring(page_text)
+    except lxml.etree.ParserError:
+        # nothing to parse, e.g. an empty page
+        return []
+
+    band_disco_rows = list(band_tree.iter('tr'))[1:]
+
+    album_records = []
+    for table_row in band_disco_rows:
+        table_data = list(table_row.iter('td'))
+
+        album_link = next(table_data[0].iter('a'), None)
+        if album_link is None:
+            break
+
+        album_url = album_link.get('href')
+        album_name = album_link.text_content()
+        album_id = album_url.split('/')[-1]
+
+        album_type = table_data[1].text_content()
+
+        year = table_data[2].text_content()
+
+        review = table_data[3].text_content().strip()
+        record = (band_id, band_name, album_id, album_name,
+                  album_type, year, review, album_url)
+        album_records.append(record)
+
+    return album_records
+
+
 def _create_discography_urls(bands_df: pd.DataFrame) -> list:
     # construct endpoints for each bands discography
 
@@ -223,37 +1245,380 @@ def _create_discography_urls(bands_df: pd.DataFrame) -> list:
     band_records = bands_df[['metallum_band_id', 'name']].iterrows()
     for _, (band_id, band_name) in band_records:
         endpoint = f'band/discography/id/{band_id}/tab/all'
-        discography_url = f'https://www.metal-archives.com/{endpoint}'
+        discography_url = f'{METAL_ARCHIVES_URL}/{endpoint}'
         discography_urls.append((band_id, band_name, discography_url))
 
     return discography_urls
 
 
-class AlbumParseException(Exception):
-    """Album data could not be parsed"""
+class IdBitmap:
+    '''A thread-safe set of non-negative integer IDs, stored as one bit
+    per ID'''
+
+    def __init__(self, bits=None, count=0):
+        self._bits = bytearray() if bits is None else bits
+        self._count = count
+        self._lock = thr.Lock()
+
+    def add(self, item_id):
+        """Adds an ID, returning False if it was already present"""
+        byte, bit = divmod(item_id, 8)
+        mask = 1 << bit
+
+        with self._lock:
+            if byte >= len(self._bits):
+                # grow geometrically so that ascending IDs stay cheap
+                growth = max(byte + 1 - len(self._bits), len(self._bits))
+                self._bits.extend(bytes(growth))
+
+            if self._bits[byte] & mask:
+                return False
+
+            self._bits[byte] |= mask
+            self._count += 1
+            return True
+
+    def __contains__(self, item_id):
+        byte, bit = divmod(item_id, 8)
+        bits = self._bits
+        return byte < len(bits) and bool(bits[byte] & (1 << bit))
+
+    def __len__(self):
+        return self._count
+
+    def copy(self):
+        with self._lock:
+            return IdBitmap(bytearray(self._bits), self._count)
+
+    def save(self, path, position=0):
+        """Writes the bitmap, along with the position in some other file
+        that it is up to date with"""
+        with self._lock:
+            header = struct.pack('<QQ', self._count, position)
+            with open(f'{path}.tmp', 'wb') as bitmap_file:
+                bitmap_file.write(header)
+                bitmap_file.write(self._bits)
+                bitmap_file.flush()
+                os.fsync(bitmap_file.fileno())
+            os.replace(f'{path}.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Returns a saved bitmap and its position, or an empty bitmap"""
+        try:
+            with open(path, 'rb') as bitmap_file:
+                count, position = struct.unpack('<QQ', bitmap_file.read(16))
+                return cls(bytearray(bitmap_file.read()), count), position
+        except (FileNotFoundError, struct.error):
+            return cls(), 0
+
+
+class CheckpointLog:
+    '''An append-only CSV written in fsync'd batches. Every batch adds a
+    line per key to an index file, along with the size and row count of the
+    CSV once the batch was on disk. Checkpointed keys are also kept in an
+    IdBitmap saved next to the index, so resuming only reads the part of the
+    index written since the bitmap was last saved'''
+
+    def __init__(self, path, columns, key_id, index_path=None):
+        self.path = path
+        self.columns = columns
+        self.key_id = key_id
+        self.index_path = index_path or f'{path}.index'
+        self.bitmap_path = f'{self.index_path}.bitmap'
+
+        self.row_count = 0
+        self._lock = thr.Lock()
+        self.ids = self._recover()
+
+    def _recover(self):
+        if not os.path.exists(self.index_path):
+            self._index_existing_csv()
+
+        index_bytes, last_line = self._last_index_line()
+
+        with open(self.index_path, 'r+b') as index_file:
+            index_file.truncate(index_bytes)
+
+        offset = 0
+        if last_line is not None:
+            offset, row_count, _ = last_line.split('\t', 2)
+            offset, self.row_count = int(offset), int(row_count)
+
+        # drop rows from a batch that never made it into the index
+        self._discard_after(offset)
+
+        ids, position = IdBitmap.load(self.bitmap_path)
+        if position > index_bytes:
+            ids, position = IdBitmap(), 0
+
+        for key in self.read_keys(position):
+            ids.add(self.key_id(key))
+
+        return ids
+
+    def _last_index_line(self):
+        """Returns the length of the index up to its last complete line,
+        along with that line. A line without a newline was cut off
+        mid-write and is ignored"""
+        with open(self.index_path, 'rb') as index_file:
+            end = index_file.seek(0, os.SEEK_END)
+            tail_size = 4096
+            while True:
+                start = max(0, end - tail_size)
+                index_file.seek(start)
+                tail = index_file.read(end - start)
+                lines = tail.split(b'\n')
+
+                # lines[-1] is whatever follows the final newline
+                if len(lines) > 2 or (start == 0 and len(lines) > 1):
+                    index_bytes = end - len(lines[-1])
+                    return index_bytes, lines[-2].decode('utf-8')
+
+                if start == 0:
+                    return 0, None
+
+                tail_size *= 2
+
+    def read_keys(self, position=0):
+        """Yields the checkpointed keys, starting from a byte position"""
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(position)
+            for line in index_file:
+                if not line.endswith(b'\n'):
+                    break
+                yield line[:-1].decode('utf-8').split('\t', 2)[2]
+
+    def _index_existing_csv(self):
+        """Builds an index for a CSV written before checkpoints existed"""
+        lines = []
+        if os.path.exists(self.path):
+            keys_df = pd.read_csv(self.path, usecols=['album_url'])
+            offset = os.path.getsize(self.path)
+            lines = [f'{offset}\t{len(keys_df)}\t{key}\n'
+                     for key in keys_df['album_url'].unique()]
+
+        with open(self.index_path, 'w', encoding='utf-8') as index_file:
+            index_file.writelines(lines)
+
+    def _discard_after(self, offset):
+        if os.path.exists(self.path):
+            with open(self.path, 'r+b') as csv_file:
+                csv_file.truncate(offset)
+
+    def _write_rows(self, batch):
+        """Writes and syncs the rows of a batch, returning the offset to
+        record in the index"""
+        write_header = not os.path.exists(self.path) \
+            or os.path.getsize(self.path) == 0
+
+        with open(self.path, 'a', newline='', encoding='utf-8') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            if write_header:
+                writer.writerow(self.columns)
+            for _, rows in batch:
+                writer.writerows(rows)
+                self.row_count += len(rows)
+
+            file.flush()
+            os.fsync(file.fileno())
+            return file.tell()
+
+    def append(self, batch):
+        """Writes a batch of (key, rows) pairs and checkpoints it"""
+        if not batch:
+            return
+
+        with self._lock:
+            offset = self._write_rows(batch)
+
+            with open(self.index_path, 'a', encoding='utf-8') as index_file:
+                index_file.writelines(f'{offset}\t{self.row_count}\t{key}\n'
+                                      for key, _ in batch)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+                index_bytes = index_file.tell()
+
+            for key, _ in batch:
+                self.ids.add(self.key_id(key))
+            self.ids.save(self.bitmap_path, index_bytes)
+
+
+class ParquetCheckpointLog(CheckpointLog):
+    '''A CheckpointLog that writes every batch to its own Parquet file in a
+    directory, which can be read back as a single dataset. Offsets in the
+    index count files rather than bytes'''
+
+    SHARD_PATTERN = re.compile(r'^part-(\d+)\.parquet$')
+
+    def __init__(self, path, columns, key_id, index_path=None, dtypes=None):
+        self.dtypes = dtypes or {}
+        self._shard_count = 0
+        super().__init__(path, columns, key_id, index_path)
+
+    def _shard_path(self, number):
+        return os.path.join(self.path, f'part-{number:06d}.parquet')
+
+    def _shard_numbers(self):
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
 
+        shard_matches = map(self.SHARD_PATTERN.match, names)
+        return sorted(int(match.group(1)) for match in shard_matches
+                      if match is not None)
 
-def _get_album_tracks(album):
-    url = album['album_url']
-    album_webpage = requests.get(url)
+    def _discard_after(self, offset):
+        for number in self._shard_numbers():
+            if number >= offset:
+                os.remove(self._shard_path(number))
 
-    if album_webpage.status_code == 520:
-        time.sleep(15)
-        album_webpage = requests.get(url)
+        self._shard_count = offset
 
-    try:
-        album_soup = bs.BeautifulSoup(album_webpage.text, 'html.parser')
+    def _write_rows(self, batch):
+        rows = [row for _, batch_rows in batch for row in batch_rows]
+        batch_df = pd.DataFrame(rows, columns=self.columns)
+        batch_df = batch_df.astype(self.dtypes)
 
-        track_table_attributes = {'class': 'display table_lyrics'}
-        track_attributes = {'class': ['even', 'odd']}
+        os.makedirs(self.path, exist_ok=True)
 
-        album_track_soup = album_soup.find('table', track_table_attributes)
-        track_soup = album_track_soup.find_all('tr', track_attributes)
+        # readers skip dot files, so a half-written shard is never read
+        shard_path = self._shard_path(self._shard_count)
+        directory, name = os.path.split(shard_path)
+        temp_path = os.path.join(directory, f'.{name}.tmp')
 
-        track_records = [[td.text.strip() for td in tr.find_all('td')]
-                         for tr in track_soup]
-    except Exception:
-        raise AlbumParseException()
+        with open(temp_path, 'wb') as file:
+            batch_df.to_parquet(file, index=False,
+                                row_group_size=PARQUET_ROW_GROUP_SIZE)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, shard_path)
+
+        self.row_count += len(rows)
+        self._shard_count += 1
+        return self._shard_count
+
+    def _index_existing_csv(self):
+        """Rebuilds a lost index from the shards already written"""
+        shard_numbers = self._shard_numbers()
+
+        lines = []
+        row_count = 0
+        for shard_count, number in enumerate(shard_numbers, start=1):
+            if number != shard_count - 1:
+                # shards after a gap can't be trusted
+                break
+
+            keys_df = pd.read_parquet(self._shard_path(number),
+                                      columns=['album_url'])
+            row_count += len(keys_df)
+            lines.extend(f'{shard_count}\t{row_count}\t{key}\n'
+                         for key in keys_df['album_url'].unique())
+
+        with open(self.index_path, 'w', encoding='utf-8') as index_file:
+            index_file.writelines(lines)
+
+
+def _output_path(name, output_format=None):
+    return f'out/{name}.{output_format or Output.format}'
+
+
+def _write_output(df, name):
+    """Writes a stage's output in the configured format"""
+    path = _output_path(name)
+
+    if Output.format == 'parquet':
+        df = df.astype(OUTPUT_DTYPES.get(name, {}))
+        df.to_parquet(path, index=False,
+                      row_group_size=PARQUET_ROW_GROUP_SIZE)
+    else:
+        df.to_csv(path, index=False)
+
+
+def _read_output(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def _open_track_log():
+    path = _output_path('tracks')
+
+    if Output.format == 'parquet':
+        return ParquetCheckpointLog(path, TRACK_COLUMNS, _album_id_from_url,
+                                    dtypes=OUTPUT_DTYPES['tracks'])
+    return CheckpointLog(path, TRACK_COLUMNS, _album_id_from_url)
+
+
+def _append_to_csv(path, columns, rows):
+    if not rows:
+        return
+
+    write_header = not os.path.exists(path)
+    with open(path, 'a', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, lineterminator='\n')
+        if write_header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def _previous_path(path):
+    root, extension = os.path.splitext(path)
+    return f'{root}_previous{extension}'
+
+
+def _snapshot_previous(path):
+    """Keeps the last version of an output around for incremental runs"""
+    if os.path.exists(path):
+        os.replace(path, _previous_path(path))
+
+
+def _write_tombstones(entity, metallum_ids, urls):
+    """Records rows that have disappeared from the site since the last run"""
+    tombstones_df = pd.DataFrame({'entity': entity,
+                                  'metallum_id': list(metallum_ids),
+                                  'url': list(urls),
+                                  'removed_on': dt.date.today().isoformat()})
+
+    write_header = not os.path.exists(TOMBSTONES_CSV)
+    if not write_header:
+        # rows stay tombstoned across runs, only record them once
+        recorded_df = pd.read_csv(TOMBSTONES_CSV, usecols=['entity', 'url'])
+        is_entity = recorded_df['entity'] == entity
+        is_recorded = tombstones_df['url'].isin(recorded_df['url'][is_entity])
+        tombstones_df = tombstones_df[~is_recorded]
+
+    if tombstones_df.empty:
+        return
+
+    tombstones_df.to_csv(TOMBSTONES_CSV, mode='a', header=write_header,
+                         index=False)
+
+
+def _diff_bands(bands_df, previous_bands_df):
+    """Returns the bands that are new or changed since the previous snapshot,
+    along with the bands that no longer exist"""
+    previous_bands_df = previous_bands_df.drop_duplicates()
+    merged_df = bands_df.merge(previous_bands_df, how='left', indicator=True)
+    is_changed = (merged_df['_merge'] == 'left_only').values
+
+    band_ids = bands_df['metallum_band_id']
+    is_removed = ~previous_bands_df['metallum_band_id'].isin(band_ids)
+
+    return bands_df[is_changed], previous_bands_df[is_removed]
+
+
+def _album_id_from_url(album_url):
+    return int(album_url.split('/')[-1])
+
+
+def _parse_album_tracks(album, page_text, backend=None):
+    """Returns the tracks on an album's page"""
+    if (backend or Parsing.backend) == 'lxml':
+        track_records = _parse_track_table_lxml(page_text)
+    else:
+        track_records = _parse_track_table_bs4(page_text)
 
     tracks = list(map(lambda n: n[1].replace('\n', ' '), track_records))
     track_numbers = \
@@ -264,7 +1629,7 @@ def _get_album_tracks(album):
     band_name = [album['band_name']] * len(tracks)
     album_id = [album['metallum_album_id']] * len(tracks)
     album_name = [album['album_name']] * len(tracks)
-    album_url = [url] * len(tracks)
+    album_url = [album['album_url']] * len(tracks)
 
     dataset = [band_id, band_name, album_id, album_name, album_url,
                tracks, track_numbers, track_lengths]
@@ -272,252 +1637,477 @@ def _get_album_tracks(album):
     return list(zip(*dataset))
 
 
-def download_all_bands():
-    """Get every band from Encyclopaedia Metallum using the website API"""
-    bands = list()
+def _parse_track_table_bs4(page_text):
+    try:
+        album_soup = bs.BeautifulSoup(page_text, 'html.parser')
+
+        track_table_attributes = {'class': 'display table_lyrics'}
+        track_attributes = {'class': ['even', 'odd']}
 
-    # threadable function that reads letters from a queue (q) and then
-    # retrieves the metal bands beginning with each returned letter
-    def _download_by_letter_concurrently():
-        halting = False
-        while not halting:
-            letter = queue.get()
+        album_track_soup = album_soup.find('table', track_table_attributes)
+        track_soup = album_track_soup.find_all('tr', track_attributes)
+
+        track_records = [[td.text.strip() for td in tr.find_all('td')]
+                         for tr in track_soup]
+    except Exception:
+        raise AlbumParseException()
 
-            halting = letter == 0
+    return track_records
 
-            if not halting:
-                display_letter = '#' if letter == 'NBR' else letter
-                msg = f'bands | {display_letter} | starting download'
-                Output.log.message(msg)
-                bands_data = _get_metallum_records_by_letter(letter)
-                for datum in bands_data:
-                    bands.append(datum)
-                msg = f'bands | {display_letter} | download complete'
+
+TRACK_TABLE_PATTERN = \
+    re.compile(r'<table\b[^>]*\bclass=([\'"])display table_lyrics\1')
+
+
+def _parse_track_table_lxml(page_text):
+    # only the track table is handed to lxml, rather than the whole page
+    table_match = TRACK_TABLE_PATTERN.search(page_text)
+    if table_match is None:
+        raise AlbumParseException()
+
+    table_end = page_text.find('</table>', table_match.start())
+    if table_end == -1:
+        table_end = len(page_text)
+
+    try:
+        table_html = page_text[table_match.start():table_end] + '</table>'
+        track_table = lxml.html.fragment_fromstring(table_html)
+
+        track_records = []
+        for table_row in track_table.iter('tr'):
+            row_classes = table_row.get('class', '').split()
+            if 'even' not in row_classes and 'odd' not in row_classes:
+                continue
+
+            track_records.append([td.text_content().strip()
+                                  for td in table_row.iter('td')])
+    except Exception:
+        raise AlbumParseException()
+
+    return track_records
+
+
+def check_parser_parity(cache_path=CACHE_DIR):
+    """Runs every installed backend over the discography and album pages in
+    the response cache, and returns the URLs of pages they disagree on.
+    Backends agree on a page they can't parse if they raise the same error"""
+    def _parse(parse_func, *args):
+        try:
+            return parse_func(*args)
+        except Exception as exc:
+            return type(exc)
+
+    backends = [backend for backend in PARSER_BACKENDS
+                if backend != 'lxml' or lxml is not None]
+
+    cache = ResponseCache(cache_path, offline=True)
+    mismatched_urls = []
+    page_count = 0
+
+    for directory, _, files in os.walk(cache_path):
+        for name in files:
+            if not name.endswith('.json'):
+                continue
+
+            with open(os.path.join(directory, name), 'r') as metadata_file:
+                url = json.load(metadata_file)['url']
+
+            if '/band/discography/' in url:
+                parse_func = _parse_band_discography
+                args = (None, None)
+            elif '/albums/' in url:
+                parse_func = _parse_album_tracks
+                args = ({'metallum_band_id': None, 'band_name': None,
+                         'metallum_album_id': None, 'album_name': None,
+                         'album_url': url},)
+            else:
+                continue
+
+            entry = cache.get(url)
+            if entry is None:
+                continue
+
+            page_text, _ = entry
+            results = [_parse(parse_func, *args, page_text, backend)
+                       for backend in backends]
+
+            page_count += 1
+            if any(result != results[0] for result in results[1:]):
+                mismatched_urls.append(url)
+
+    msg = (f'parser parity | {page_count} pages checked, '
+           f'{len(mismatched_urls)} mismatched')
+    Output.log.message(msg)
+
+    return mismatched_urls
+
+
+def download_all_bands(engine='threads'):
+    """Get every band from Encyclopaedia Metallum using the website API.
+
+    The first page of every letter gives its number of bands, then the
+    rest of the pages of every letter are downloaded together, so letters
+    with many bands are spread across every worker"""
+    pages = {}
+    letter_totals = {}
+    remaining_pages = {}
+
+    def _display_letter(letter):
+        return '#' if letter == 'NBR' else letter
+
+    # retrieves one page of the metal bands beginning with a letter
+    def _download_page(page):
+        endpoint = _create_metallum_api_endpoint(*page)
+        collector.add((page, _fetch(endpoint)))
+
+    async def _download_page_async(session, page):
+        endpoint = _create_metallum_api_endpoint(*page)
+        page_text = await _fetch_async(session, endpoint)
+
+        # the collector's queue may be full, which mustn't block the loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, collector.add, (page, page_text))
+
+    # runs on the collector's writer thread
+    def _add_pages(downloaded_pages):
+        for page, page_text in downloaded_pages:
+            letter, offset = page
+            total_records, records = _parse_letter_page(page_text)
+            pages[page] = records
+
+            if offset == 0:
+                letter_totals[letter] = total_records
+                remaining_pages[letter] = \
+                    len(_letter_page_offsets(total_records))
+                msg = (f'bands | {_display_letter(letter)} | '
+                       f'{total_records} bands')
                 Output.log.message(msg)
             else:
-                current_thread = thr.current_thread()
-                thread_msg = (f'closing {current_thread.name} '
-                              f'(ID: {current_thread.native_id})')
-                Output.log.message(thread_msg)
+                remaining_pages[letter] -= 1
 
-            queue.task_done()
+            if remaining_pages[letter] == 0:
+                msg = f'bands | {_display_letter(letter)} | download complete'
+                Output.log.message(msg)
 
-    queue = q.PriorityQueue(NUMBER_OF_THREADS * 2)
-    for _ in range(NUMBER_OF_THREADS):
-        t = thr.Thread(target=_download_by_letter_concurrently)
-        t.daemon = True
-        t.start()
+    def _remaining_pages():
+        for letter in ALPHABET:
+            for offset in _letter_page_offsets(letter_totals[letter]):
+                yield letter, offset
 
-    try:
-        # add each letter to the queue
+    # yields the bands page by page, in alphabetical order
+    def _band_records():
         for letter in ALPHABET:
-            queue.put(letter)
+            yield from pages.pop((letter, 0))
+            for offset in _letter_page_offsets(letter_totals[letter]):
+                yield from pages.pop((letter, offset))
 
-        # block main thread until downloads are complete
-        queue.join()
+    collector = ResultCollector(_add_pages, batch_size=1, stage='bands')
+    progress = metrics.registry.progress('bands')
+
+    try:
+        first_pages = [(letter, 0) for letter in ALPHABET]
+        _run(engine, first_pages, _download_page, _download_page_async)
+
+        # every letter's total is needed to know its remaining pages
+        collector.flush()
+        progress.total = len(ALPHABET) + sum(remaining_pages.values())
+
+        _run(engine, _remaining_pages(), _download_page,
+             _download_page_async)
     except KeyboardInterrupt:
         sys.exit(1)
+    finally:
+        collector.close()
+
+    _write_band_data_to_csv(_band_records())
+
+
+def download_band_details(engine='threads', incremental=False,
+                          parse_workers=PARSE_WORKERS):
+    """Retrieves discographies for the bands in bands.csv. When incremental,
+    only bands that are new or changed since the bands.csv that albums were
+    last built from are downloaded, and every other band keeps its albums
+    from the last run. A band's row in the band list doesn't change when it
+    releases an album, so new albums of otherwise unchanged bands are only
+    picked up by a full run. Bands whose discography can't be downloaded
+    are recorded in out/failed_band_urls.csv and retried by the next
+    incremental run"""
+    bands_df = _read_output(_output_path('bands'))
+    album_data = []
+    processed_band_ids = set()
+    failed_bands = []
 
-    # set threading to false and push empty values into queue
-    # this will cause the thread loops to exit, closing each thread
-    for _ in range(NUMBER_OF_THREADS):
-        queue.put(0)  # priority queues require a sortable value
+    previous_albums_df = None
+    removed_bands_df = None
 
-    _write_band_data_to_csv(bands)
+    if incremental:
+        previous_bands_df = None
+        try:
+            previous_bands_path = _previous_path(_output_path('bands'))
+            previous_bands_df = _read_output(previous_bands_path)
+            previous_albums_df = _read_output(_output_path('albums'))
+        except FileNotFoundError:
+            Output.log.message('no previous snapshot - downloading all bands')
 
+        if previous_albums_df is not None:
+            bands_df, removed_bands_df = \
+                _diff_bands(bands_df, previous_bands_df)
 
-def download_band_details():
-    """Retrieves discographies for the bands in bands.csv"""
-    bands_df = pd.read_csv('out/bands.csv')
-    album_data = []
-    processed_urls = []
-    discography_urls = _create_discography_urls(bands_df)
+            msg = (f'{len(bands_df)} new or changed bands, '
+                   f'{len(removed_bands_df)} removed bands')
+            Output.log.message(msg)
 
-    del bands_df
+            _write_tombstones('band', removed_bands_df['metallum_band_id'],
+                              removed_bands_df['url'])
 
-    def _get_albums_concurrently():
-        halting = False
-        while not halting:
-            band_data = queue.get()
+    discography_urls = _create_discography_urls(bands_df)
 
-            halting = band_data is None
+    del bands_df
 
-            if not halting:
-                _, _, discography_url = band_data
-                album_records = _download_band_discography(*band_data)
+    def _discography_url(band_data):
+        _, _, discography_url = band_data
+        return discography_url
 
-                for record in album_records:
-                    album_data.append(record)
+    def _skip_band(band_data, exc):
+        failed_bands.append(band_data)
+        Output.log.message(f'albums | skipping band | {exc}')
 
-                processed_urls.append(discography_url)
+    def _add_albums(band_data, album_records):
+        band_id, _, _ = band_data
+        collector.add((band_id, album_records))
 
-                if len(album_data) % 100 == 0:
-                    msg = (f'{len(album_data)} albums downloaded')
-                    Output.log.message(msg)
-            else:
-                current_thread = thr.current_thread()
-                thread_msg = (f'closing {current_thread.name} '
-                              f'(ID: {current_thread.native_id})')
-                Output.log.message(thread_msg)
+    # runs on the collector's writer thread
+    def _save_albums(results):
+        for band_id, album_records in results:
+            album_data.extend(album_records)
+            processed_band_ids.add(band_id)
 
-            queue.task_done()
+        msg = (f'{len(album_data)} albums downloaded '
+               f'(ETA {metrics.format_duration(progress.eta())})')
+        Output.log.message(msg)
 
-    Output.log.message('starting threads')
+    collector = ResultCollector(_save_albums, stage='albums')
+    progress = metrics.registry.progress('albums', len(discography_urls))
 
-    queue = q.Queue(NUMBER_OF_THREADS * 2)
-    for _ in range(NUMBER_OF_THREADS):
-        t = thr.Thread(target=_get_albums_concurrently)
-        t.daemon = True
-        t.start()
+    Output.log.message(f'starting {engine} engine')
 
     try:
-        for band_data in discography_urls:
-            queue.put(band_data)
-
-        queue.join()
+        _crawl(engine, discography_urls, _discography_url,
+               _parse_discography_page, _add_albums, _skip_band,
+               parse_workers)
     except KeyboardInterrupt:
         sys.exit(1)
-
-    for _ in range(NUMBER_OF_THREADS):
-        queue.put(None)
+    finally:
+        collector.close()
 
     album_headers = ('metallum_band_id', 'band_name', 'metallum_album_id',
                      'album_name', 'album_type', 'year', 'review', 'album_url')
     albums_df = pd.DataFrame(album_data, columns=album_headers)
-    albums_df.to_csv('out/albums.csv', index=False)
 
-
-def download_all_tracks():
-    albums_df = pd.read_csv('out/albums.csv')
+    if previous_albums_df is not None:
+        # albums of bands that were re-downloaded or removed are replaced;
+        # bands whose download failed keep their previous albums
+        stale_band_ids = processed_band_ids
+        stale_band_ids.update(removed_bands_df['metallum_band_id'])
+        band_ids = previous_albums_df['metallum_band_id']
+        is_stale = band_ids.isin(stale_band_ids)
+
+        stale_albums_df = previous_albums_df[is_stale]
+        album_urls = albums_df['album_url']
+        removed_albums_df = \
+            stale_albums_df[~stale_albums_df['album_url'].isin(album_urls)]
+        _write_tombstones('album', removed_albums_df['metallum_album_id'],
+                          removed_albums_df['album_url'])
+
+        albums_df = pd.concat([previous_albums_df[~is_stale], albums_df],
+                              ignore_index=True)
+
+    _snapshot_previous(_output_path('albums'))
+    _write_output(albums_df, 'albums')
+
+    _append_to_csv('out/failed_band_urls.csv', FAILED_BAND_COLUMNS,
+                   failed_bands)
+
+    # the next incremental run diffs against the bands processed here.
+    # bands whose discography failed are left out, so that it retries them
+    snapshot_df = _read_output(_output_path('bands'))
+    failed_band_ids = [band_id for band_id, _, _ in failed_bands]
+    is_failed = snapshot_df['metallum_band_id'].isin(failed_band_ids)
+    _write_output(snapshot_df[~is_failed], 'bands_previous')
+
+
+def download_all_tracks(engine='threads', incremental=False,
+                        parse_workers=PARSE_WORKERS):
+    """Retrieves the tracks of every album in albums.csv that hasn't been
+    downloaded yet. When incremental, tracks of albums that have left
+    albums.csv are recorded as tombstones"""
+    albums_df = _read_output(_output_path('albums'))
     selection = ['metallum_band_id', 'band_name', 'metallum_album_id',
                  'album_name', 'album_url']
     album_data = albums_df[selection]
 
-    downloaded_tracks = []
-    urls_processed = []
-    failed_urls = []
-
     # check to see if any data has already been downloaded
     # if so, continue off of that
-    try:
-        processed_tracks_df = pd.read_csv('out/tracks.csv')
-        urls_processed = list(processed_tracks_df['album_url'].unique())
-        processed_track_records = processed_tracks_df.to_records(index=False)
-        downloaded_tracks = [tuple(n) for n in processed_track_records]
-        del processed_tracks_df
-    except FileNotFoundError:
-        pass
+    track_log = _open_track_log()
+    albums_processed = track_log.ids.copy()
 
-    try:
-        failed_urls_df = pd.read_csv('out/failed_album_urls.csv')
-        failed_urls = [tuple(n) for n in failed_urls_df.to_records()]
-        del failed_urls_df
-    except FileNotFoundError:
-        pass
+    if incremental:
+        album_ids = set(album_data['metallum_album_id'].tolist())
+        removed_urls = [url for url in track_log.read_keys()
+                        if _album_id_from_url(url) not in album_ids]
+        removed_ids = [_album_id_from_url(url) for url in removed_urls]
+        _write_tombstones('track', removed_ids, removed_urls)
 
     def _update_view():
         """Textual output"""
-        percentage = (len(urls_processed) / len(album_data)) * 100
-        estimated = (len(downloaded_tracks) / percentage) * 100
-        message = f'{len(downloaded_tracks)} tracks downloaded'
-        message += \
-            f' ({percentage:.2f}% of an estimated {estimated:.1e} records)'
+        message = f'{track_log.row_count} tracks downloaded'
+
+        album_count = len(albums_processed)
+        if album_count and len(album_data):
+            percentage = (album_count / len(album_data)) * 100
+            estimated = (track_log.row_count / album_count) * len(album_data)
+            message += \
+                f' ({percentage:.2f}% of an estimated {estimated:.1e} records)'
 
+        message += (f', {progress.rate():.1f} albums/s, '
+                    f'ETA {metrics.format_duration(progress.eta())}')
         Output.log.message(message)
 
-    def _save_records():
-        """Save data and record which bands caused errors"""
-        tracks = copy.deepcopy(downloaded_tracks)
-        tracks_df = pd.DataFrame(tracks)
-        tracks_df.columns = ('metallum_band_id', 'band_name',
-                             'metallum_album_id', 'album_name',
-                             'album_url', 'track_name', 'track_number',
-                             'track_length')
+    # runs on the collector's writer thread
+    def _save_records(results):
+        """Checkpoint finished tracks and record which albums caused errors"""
+        batch = []
+        failed_records = []
 
-        tracks_df.to_csv('out/tracks.csv', index=False)
+        for album, tracks in results:
+            if tracks is None:
+                failed_records.append(tuple(album))
+            elif albums_processed.add(int(album['metallum_album_id'])):
+                batch.append((album['album_url'], tracks))
 
-        failed_records = copy.deepcopy(failed_urls)
-        if len(failed_records) > 0:
-            failed_records_df = pd.DataFrame(failed_records)
-            failed_records_df.columns = ('metallum_band_id', 'band_name',
-                                         'album_id', 'album_name', 'album_url')
+        track_log.append(batch)
+        _append_to_csv('out/failed_album_urls.csv', FAILED_ALBUM_COLUMNS,
+                       failed_records)
 
-            failed_records_df.to_csv('out/failed_album_urls.csv', index=False)
+        if batch:
+            _update_view()
 
-    def _get_album_tracks_concurrently():
-        halting = False
-        while not halting:
-            album_data = queue.get()
+    collector = ResultCollector(_save_records, write_size=CHECKPOINT_SIZE,
+                                stage='tracks')
 
-            halting = album_data is None
+    album_ids = album_data['metallum_album_id'].tolist()
+    pending_albums = sum(1 for album_id in album_ids
+                         if int(album_id) not in albums_processed)
+    progress = metrics.registry.progress('tracks', pending_albums)
 
-            if not halting:
-                album_url = album_data['album_url']
-                if album_url not in urls_processed:
-                    try:
-                        tracks = _get_album_tracks(album_data)
-                    except AlbumParseException:
-                        failed_urls.append(album_data)
-                    else:
-                        for track in tracks:
-                            downloaded_tracks.append(track)
-                        urls_processed.append(album_url)
-
-                if len(urls_processed) % 1000 == 0:
-                    _update_view()
+    def _album_url(album):
+        return album['album_url']
 
-            else:
-                current_thread = thr.current_thread()
-                thread_msg = (f'closing {current_thread.name} '
-                              f'(ID: {current_thread.native_id})')
-                Output.log.message(thread_msg)
+    def _add_failed_album(album, _):
+        collector.add((album, None))
 
-            queue.task_done()
+    def _add_tracks(album, tracks):
+        collector.add((album, tracks))
 
-    queue = q.Queue(NUMBER_OF_THREADS * 2)
-    for _ in range(NUMBER_OF_THREADS):
-        t = thr.Thread(target=_get_album_tracks_concurrently)
-        t.daemon = True
-        t.start()
+    album_records = (album_record for _, album_record in album_data.iterrows()
+                     if int(album_record['metallum_album_id'])
+                     not in albums_processed)
 
     try:
-        for _, album_record in album_data.iterrows():
-            queue.put(album_record)
-
-        queue.join()
+        _crawl(engine, album_records, _album_url, _parse_album_tracks,
+               _add_tracks, _add_failed_album, parse_workers)
     except KeyboardInterrupt:
-        _save_records()
+        collector.close()
         sys.exit(1)
     except Exception:
-        _save_records()
+        collector.close()
         raise
 
     Output.log.message('tracks downloaded - saving data')
 
-    _save_records()
+    collector.close()
+
+
+def download_data(bands=True, albums=False, tracks=False,
+                  pool_size=POOL_SIZE, engine='threads', cache=True,
+                  cache_ttl=CACHE_TTL, offline=False, incremental=False,
+                  parser='bs4', parse_workers=PARSE_WORKERS,
+                  output_format='csv', threads=NUMBER_OF_THREADS,
+                  concurrency=ASYNC_CONCURRENCY, metrics_path=METRICS_PATH,
+                  rate=RATE_LIMIT, max_rate=MAX_RATE_LIMIT):
+    """Runs the requested crawl stages on `threads` threads, or with
+    `concurrency` requests in flight on the async engine. Cached pages are
+    revalidated with the site unless they are younger than cache_ttl
+    seconds. With offline=True, pages are only read from the response
+    cache, so the parsers can be re-run without touching the network. With
+    incremental=True, every cached page is revalidated and only bands and
+    albums that changed since the previous run are downloaded. With
+    parse_workers, pages are parsed by that many
+    processes. Outputs are written as CSV, or as typed Parquet with
+    output_format='parquet'. Metrics are snapshotted to metrics_path.json
+    and metrics_path.prom while the stages run. Requests start at `rate`
+    per second, and the rate adapts to the site up to max_rate, if set"""
+    if pool_size != Network.sessions.pool_size:
+        Network.sessions.close()
+        Network.sessions = SessionPool(pool_size)
+
+    if offline and not cache:
+        raise ValueError('offline mode requires the response cache')
+
+    if parser not in PARSER_BACKENDS:
+        msg = f'parser must be one of {PARSER_BACKENDS}, not {parser!r}'
+        raise ValueError(msg)
+    if parser == 'lxml' and lxml is None:
+        raise ImportError('the lxml parser backend requires lxml')
+
+    Parsing.backend = parser
+    Network.limiter = RateLimiter(rate, max_rate=max_rate)
+    Network.threads = threads
+    Network.concurrency = concurrency
+
+    if output_format not in OUTPUT_FORMATS:
+        msg = (f'output_format must be one of {OUTPUT_FORMATS}, '
+               f'not {output_format!r}')
+        raise ValueError(msg)
+    if output_format == 'parquet' and pyarrow is None:
+        raise ImportError('the parquet output format requires pyarrow')
+
+    Output.format = output_format
+
+    # an incremental run has to see every change, so nothing is served
+    # from the cache without revalidating it
+    if incremental:
+        cache_ttl = 0
+
+    Network.cache = None
+    if cache:
+        Network.cache = ResponseCache(ttl=cache_ttl, offline=offline)
 
-    for _ in range(NUMBER_OF_THREADS):
-        queue.put(None)
-    queue.join()
-
-
-def download_data(bands=True, albums=False, tracks=False):
     try:
         os.mkdir('out')
     except FileExistsError:
         pass
 
-    if bands:
-        Output.log.message('downloading bands')
-        download_all_bands()
+    snapshots = contextlib.nullcontext()
+    if metrics_path is not None:
+        snapshots = metrics.SnapshotWriter(metrics.registry, metrics_path)
+
+    with snapshots:
+        if bands:
+            Output.log.message('downloading bands')
+            download_all_bands(engine)
+
+        if albums:
+            Output.log.message('downloading band details')
+            download_band_details(engine, incremental, parse_workers)
 
-    if albums:
-        Output.log.message('downloading band details')
-        download_band_details()
+        if tracks:
+            Output.log.message('downloading tracks')
+            download_all_tracks(engine, incremental, parse_workers)
 
-    if tracks:
-        Output.log.message('downloading tracks')
-        download_all_tracks()
+    if Network.cache is not None and not offline:
+        Output.log.message('evicting old pages from the response cache')
+        Network.cache.evict()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,397 @@
+"""Counters, gauges, histograms and progress estimates for the crawler and
+the DB pipeline, written out periodically as JSON and in the Prometheus
+text format"""
+
+import os
+import re
+import json
+import math
+import time
+import tempfile
+import contextlib
+import collections
+
+import datetime as dt
+import threading as thr
+
+
+METRIC_PREFIX = 'metallum'
+
+# upper bounds, in seconds, of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, 300.0, math.inf)
+
+# seconds between snapshots, and the seconds of progress used to estimate
+# the current rate of a stage
+SNAPSHOT_INTERVAL = 60
+PROGRESS_WINDOW = 300
+
+METRICS_FILE_MODE = 0o644
+
+LABEL_ESCAPES = (('\\', '\\\\'), ('"', '\\"'), ('\n', '\\n'))
+
+
+class Histogram:
+    '''Counts observations into cumulative buckets'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+    def merge(self, state):
+        for index, count in enumerate(state['counts']):
+            self.counts[index] += count
+        self.count += state['count']
+        self.sum += state['sum']
+
+    def quantile(self, q):
+        """Estimates a quantile as the upper bound of its bucket"""
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.buckets[-1]
+
+    def state(self):
+        return {'counts': list(self.counts), 'count': self.count,
+                'sum': self.sum}
+
+
+class Progress:
+    '''How much of a stage is done. The rate is measured over the last
+    `window` seconds, so the ETA follows the crawl as it speeds up or is
+    throttled'''
+
+    def __init__(self, total=None, window=PROGRESS_WINDOW):
+        self.total = total
+        self.done = 0
+        self.window = window
+        self.start = time.monotonic()
+        self.finished = None
+        self._samples = collections.deque([(self.start, 0)])
+
+    def advance(self, count=1):
+        self.done += count
+
+        now = time.monotonic()
+        self._samples.append((now, self.done))
+        if self.total is not None and self.done >= self.total:
+            self.finished = now
+
+        while len(self._samples) > 2 and \
+                now - self._samples[1][0] > self.window:
+            self._samples.popleft()
+
+    def rate(self):
+        """Items per second over the recent window"""
+        now = self.finished or time.monotonic()
+        start_time, start_done = self._samples[0]
+        if now <= start_time:
+            return 0.0
+        return (self.done - start_done) / (now - start_time)
+
+    def eta(self):
+        """Seconds until the stage is done, or None if it can't be told"""
+        if self.total is None:
+            return None
+
+        rate = self.rate()
+        if not rate:
+            return None
+        return max(0, self.total - self.done) / rate
+
+    def state(self):
+        end = self.finished or time.monotonic()
+        return {'done': self.done, 'total': self.total,
+                'rate': self.rate(), 'eta_seconds': self.eta(),
+                'elapsed_seconds': end - self.start}
+
+
+class Metrics:
+    '''A thread-safe registry of named metrics. Each metric can be split by
+    keyword labels, e.g. count('fetch_responses_total', status=200)'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drops every metric. The lock is replaced too, as a forked process
+        may have inherited it while another thread held it"""
+        self._lock = thr.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.progresses = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value))
+                                  for key, value in labels.items()))
+
+    def count(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observes how long the block takes, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def progress(self, stage, total=None):
+        """Starts tracking the progress of a stage"""
+        progress = Progress(total)
+        with self._lock:
+            self.progresses[stage] = progress
+        return progress
+
+    def advance(self, stage, count=1):
+        with self._lock:
+            progress = self.progresses.get(stage)
+            if progress is not None:
+                progress.advance(count)
+
+    def state(self):
+        """The raw metrics, which another process can merge()"""
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'gauges': dict(self.gauges),
+                    'histograms': {key: histogram.state() for key, histogram
+                                   in self.histograms.items()}}
+
+    def merge(self, state):
+        with self._lock:
+            for key, amount in state['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + amount
+
+            self.gauges.update(state['gauges'])
+
+            for key, histogram_state in state['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(histogram_state)
+
+    def snapshot(self):
+        """Returns every metric as JSON-serializable values"""
+        with self._lock:
+            counters = {_series_name(key): value
+                        for key, value in self.counters.items()}
+            gauges = {_series_name(key): value
+                      for key, value in self.gauges.items()}
+
+            histograms = {}
+            for key, histogram in self.histograms.items():
+                histograms[_series_name(key)] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'mean': histogram.sum / histogram.count,
+                    'p50': _finite(histogram.quantile(0.5)),
+                    'p95': _finite(histogram.quantile(0.95)),
+                    'p99': _finite(histogram.quantile(0.99))
+                }
+
+            progress = {stage: stage_progress.state()
+                        for stage, stage_progress in self.progresses.items()}
+
+        return {'time': dt.datetime.now(dt.timezone.utc).isoformat(),
+                'uptime_seconds': time.time() - self.started,
+                'counters': counters, 'gauges': gauges,
+                'histograms': histograms, 'progress': progress}
+
+    def prometheus(self):
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+
+        with self._lock:
+            for metric_type, series in (('counter', self.counters),
+                                        ('gauge', self.gauges)):
+                for name, values in _by_name(series):
+                    lines.append(f'# TYPE {_metric_name(name)} '
+                                 f'{metric_type}')
+                    lines.extend(f'{_metric_name(name)}{_labels(labels)} '
+                                 f'{_number(value)}'
+                                 for labels, value in values)
+
+            for name, values in _by_name(self.histograms):
+                metric_name = _metric_name(name)
+                lines.append(f'# TYPE {metric_name} histogram')
+
+                for labels, histogram in values:
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        cumulative += count
+                        le = (('le', '+Inf' if bound == math.inf
+                               else repr(bound)),)
+                        lines.append(f'{metric_name}_bucket'
+                                     f'{_labels(labels + le)} {cumulative}')
+                    lines.append(f'{metric_name}_sum{_labels(labels)} '
+                                 f'{_number(histogram.sum)}')
+                    lines.append(f'{metric_name}_count{_labels(labels)} '
+                                 f'{histogram.count}')
+
+            progress_states = [(stage, progress.state()) for stage, progress
+                               in self.progresses.items()]
+
+        for field in ('done', 'total', 'rate', 'eta_seconds'):
+            metric_name = _metric_name(f'progress_{field}')
+            values = [(stage, state[field]) for stage, state
+                      in progress_states if state[field] is not None]
+            if values:
+                lines.append(f'# TYPE {metric_name} gauge')
+                lines.extend(f'{metric_name}{_labels((("stage", stage),))} '
+                             f'{_number(value)}' for stage, value in values)
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Writes path.json and path.prom, replacing them atomically"""
+        _replace_file(f'{path}.json', json.dumps(self.snapshot(), indent=2))
+        _replace_file(f'{path}.prom', self.prometheus())
+
+
+class SnapshotWriter:
+    '''Writes the registry's metrics every `interval` seconds from a
+    background thread, and once more when stopped'''
+
+    def __init__(self, metrics, path, interval=SNAPSHOT_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stopping = thr.Event()
+        self._thread = None
+
+    def _write_snapshots(self):
+        while not self._stopping.wait(self.interval):
+            self.metrics.write(self.path)
+
+    def start(self):
+        self._thread = thr.Thread(target=self._write_snapshots)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.metrics.write(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _series_name(key):
+    name, labels = key
+    if not labels:
+        return name
+    label_text = ','.join(f'{label}={value}' for label, value in labels)
+    return f'{name}{{{label_text}}}'
+
+
+def _by_name(series):
+    grouped = {}
+    for (name, labels), value in sorted(series.items(),
+                                        key=lambda item: item[0]):
+        grouped.setdefault(name, []).append((labels, value))
+    return grouped.items()
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f'{METRIC_PREFIX}_{name}')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    pairs = []
+    for label, value in labels:
+        for character, escaped in LABEL_ESCAPES:
+            value = value.replace(character, escaped)
+        pairs.append(f'{label}="{value}"')
+
+    return '{' + ','.join(pairs) + '}'
+
+
+def _finite(value):
+    # json has no infinity
+    return None if value == math.inf else value
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _replace_file(path, text):
+    directory = os.path.dirname(path) or '.'
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                     prefix='.metrics', suffix='.tmp',
+                                     delete=False) as file:
+        file.write(text)
+
+    # temporary files are only readable by their owner, and a collector
+    # scraping the prometheus file may run as another user
+    os.chmod(file.name, METRICS_FILE_MODE)
+    os.replace(file.name, path)
+
+
+def format_duration(seconds):
+    """Formats a number of seconds like 2d 03h 04m"""
+    if seconds is None:
+        return 'unknown'
+
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+
+    if days:
+        return f'{days}d {hours:02}h {minutes:02}m'
+    if hours:
+        return f'{hours}h {minutes:02}m'
+    return f'{minutes}m {seconds:02}s'
+
+
+# shared by every module of a process
+registry = Metrics()
@@ -0,0 +1,113 @@
+"""Checks that the parser backends agree on saved discography and album
+pages. Run from the repository root with python -m pytest"""
+
+import glob
+import os
+
+import pytest
+
+import encyclopaedia_metallum_etl as etl
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+DISCOGRAPHY_PAGES = sorted(glob.glob(os.path.join(FIXTURES_DIR,
+                                                  'discography_*.html')))
+ALBUM_PAGES = sorted(glob.glob(os.path.join(FIXTURES_DIR, 'album_*.html')))
+
+ALBUM = {'metallum_band_id': 30, 'band_name': 'Emperor',
+         'metallum_album_id': 2056, 'album_name': 'In the Nightside Eclipse',
+         'album_url': f'{etl.METAL_ARCHIVES_URL}/albums/Emperor/'
+                      'In_the_Nightside_Eclipse/2056'}
+
+requires_lxml = pytest.mark.skipif(
+    etl.lxml is None, reason='the lxml parser backend requires lxml')
+
+
+def _read(path):
+    with open(path, 'r', encoding='utf-8') as page_file:
+        return page_file.read()
+
+
+def _fixture(name):
+    return _read(os.path.join(FIXTURES_DIR, name))
+
+
+def _parse(parse_func, *args):
+    # a page that can't be parsed must fail the same way in every backend
+    try:
+        return parse_func(*args)
+    except Exception as exc:
+        return type(exc)
+
+
+@requires_lxml
+@pytest.mark.parametrize('path', DISCOGRAPHY_PAGES, ids=os.path.basename)
+def test_discography_parity(path):
+    page_text = _read(path)
+    bs4_albums = _parse(etl._parse_band_discography, 30, 'Emperor',
+                        page_text, 'bs4')
+    lxml_albums = _parse(etl._parse_band_discography, 30, 'Emperor',
+                         page_text, 'lxml')
+
+    assert bs4_albums == lxml_albums
+
+
+@requires_lxml
+@pytest.mark.parametrize('path', ALBUM_PAGES, ids=os.path.basename)
+def test_album_parity(path):
+    page_text = _read(path)
+    bs4_tracks = _parse(etl._parse_album_tracks, ALBUM, page_text, 'bs4')
+    lxml_tracks = _parse(etl._parse_album_tracks, ALBUM, page_text, 'lxml')
+
+    assert bs4_tracks == lxml_tracks
+
+
+@pytest.mark.parametrize('backend', etl.PARSER_BACKENDS)
+def test_fixtures_parse(backend):
+    if backend == 'lxml' and etl.lxml is None:
+        pytest.skip('the lxml parser backend requires lxml')
+
+    albums = etl._parse_band_discography(
+        1, 'Burzum', _fixture('discography_full.html'), backend)
+    assert len(albums) == 6
+    assert albums[0] == (1, 'Burzum', '1012', 'Burzum', 'Full-length',
+                         '1992', '17 (82%)',
+                         f'{etl.METAL_ARCHIVES_URL}/albums/Burzum/Burzum/'
+                         '1012')
+    assert albums[3][6] == ''
+
+    albums = etl._parse_band_discography(
+        1, 'Sigh', _fixture('discography_entities.html'), backend)
+    assert albums[2][3] == 'Sigh & Necromantia <split>'
+
+    assert etl._parse_band_discography(
+        1, 'Burzum', _fixture('discography_empty.html'), backend) == []
+
+    tracks = etl._parse_album_tracks(ALBUM, _fixture('album_full.html'),
+                                     backend)
+    assert len(tracks) == 8
+    assert tracks[2][5:] == ('Cosmic Keys to My Creations & Times', '3',
+                             '06:06')
+
+    tracks = etl._parse_album_tracks(ALBUM, _fixture('album_multi_disc.html'),
+                                     backend)
+    assert [track[6] for track in tracks] == ['1', '2', '3', '1', '2']
+
+    with pytest.raises(etl.AlbumParseException):
+        etl._parse_album_tracks(ALBUM, _fixture('album_without_tracks.html'),
+                                backend)
+
+
+def test_check_parser_parity(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl.Output.log, '_is_enabled', False)
+
+    cache = etl.ResponseCache(str(tmp_path))
+    for number, path in enumerate(DISCOGRAPHY_PAGES):
+        url = f'{etl.METAL_ARCHIVES_URL}/band/discography/id/{number}/tab/all'
+        cache.put(url, _read(path), {})
+    for number, path in enumerate(ALBUM_PAGES):
+        url = f'{etl.METAL_ARCHIVES_URL}/albums/Band/Album/{number}'
+        cache.put(url, _read(path), {})
+
+    assert etl.check_parser_parity(str(tmp_path)) == []